@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import deque
+
+from database import mac_to_int, format_mac
+
+
+class MacAllowlist:
+    """
+    Registered MACs the tracker is allowed to store and log.
+
+    `loader` returns {mac: item name}; internally MACs are 48-bit integers
+    and `names` maps those to item names. The owner decides when to
+    reload(), and must do it on the thread that calls check(). Rejected
+    traffic is only counted, and every `sample_every`-th rejection is kept
+    in a short ring for diagnostics.
+    """
+
+    def __init__(self, loader, sample_every=50, sample_size=20):
+        self.loader = loader
+        self.sample_every = sample_every
+        self.lock = threading.Lock()
+
+        self.names = {}      # mac int -> item name
+        self.keys = {}       # raw MAC string as received -> mac int, registered only
+
+        # Counters
+        self.accepted = 0
+        self.rejected = 0
+        self.invalid = 0
+        self.reloads = 0
+        self.samples = deque(maxlen=sample_size)
+
+    def reload(self):
+        return self.replace(self.loader())
+
+    def replace(self, names):
+        """
+        Replace the registered set with `names` ({mac string: item name}).
+        Returns True if that changed the set.
+        """
+        converted = {}
+        for mac, name in names.items():
+            key = mac_to_int(mac)
+            if key is not None:
+                converted[key] = name
+        with self.lock:
+            self.reloads += 1
+            if converted == self.names:
+                return False
+            self.names = converted
+            self.keys = {}
+            return True
+
+    def registered(self):
+        """
+        The registered set as {aa:bb:cc:dd:ee:ff: item name}.
+        """
+        return {format_mac(mac): name for mac, name in self.names.items()}
+
+    def check(self, mac, room=None, rssi=None):
+        """
+        Return the MAC as an integer if it is registered, otherwise None.
+        """
+        key = self.keys.get(mac) if isinstance(mac, str) else None
+        if key is not None:
+            self.accepted += 1
+            return key
+
+        key = mac_to_int(mac)
+        if key is None:
+            self.invalid += 1
+            return None
+
+        if key in self.names:
+            # Scanners always send the same spelling, skip parsing next time
+            self.keys[mac] = key
+            self.accepted += 1
+            return key
+
+        self.rejected += 1
+        if (self.rejected - 1) % self.sample_every == 0:
+            self.samples.append({"item": format_mac(key), "room": room, "rssi": rssi, "time": time.time()})
+        return None
+
+    def stats(self):
+        return {
+            "registered": len(self.names),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "invalid": self.invalid,
+            "reloads": self.reloads,
+            "samples": list(self.samples),
+        }
@@ -0,0 +1,188 @@
+"""
+Benchmark for the Log.db event path.
+
+Runs in a scratch directory, so the real Log.db is never touched.
+
+    python bench_database.py --events 100000
+    python bench_database.py --events 0 --rows 1000000
+
+"direct" inserts and commits one event at a time into the old table, the
+way LogEvent used to, on a plain connection with SQLite's default rollback
+journal and synchronous=FULL; "writer" goes through DB.LogEvent and the
+batched EventWriter.
+
+--rows builds an events table in the old text-timestamp layout, times
+the old 14-day GetEvents query and a one-hour lookup against it, migrates
+it and times the same queries through DB.get_events.
+Results are printed as JSON.
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def make_events(count):
+    rooms = ("Bedroom", "Kitchen", "Garage", "Front Door")
+    levels = ("Info", "Info", "Info", "Warning")
+    for i in range(count):
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(1767225600 + i))
+        yield levels[i % len(levels)], f"{rooms[i % len(rooms)]}: item {i % 50} can't be found", when
+
+
+def bench_direct(database, count):
+    # Not open_connection(): no WAL, no PRAGMAS, no migration, like the original DB()
+    conn = sqlite3.connect("direct.db")
+    conn.execute("CREATE TABLE events (level TEXT, event TEXT, timestamp TEXT)")
+    conn.commit()
+    started = time.perf_counter()
+    for level, event, when in make_events(count):
+        # Parameterized only because the f-string version breaks on "can't"
+        conn.execute("INSERT INTO events (level, event, timestamp) VALUES (?, ?, ?)", (level, event, when))
+        conn.commit()
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return {"events": count, "seconds": elapsed, "events_per_second": count / elapsed}
+
+
+def bench_writer(database, count):
+    db = database.DB()
+    started = time.perf_counter()
+    for level, event, when in make_events(count):
+        db.LogEvent(level, event, when)
+    queued = time.perf_counter() - started
+    db.FlushEvents()
+    elapsed = time.perf_counter() - started
+
+    stored = db.cur.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+    return {
+        "events": count,
+        "stored": stored,
+        "seconds": elapsed,
+        "events_per_second": count / elapsed,
+        "log_call_us": queued / count * 1e6,
+        "writer": database.event_writer().stats(),
+    }
+
+
+def timed(function, repeat=3):
+    """
+    Best of `repeat` runs: (seconds, result).
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best[0]:
+            best = (elapsed, result)
+    return best
+
+
+def bench_queries(database, rows, days=60):
+    path = os.path.abspath("queries.db")
+    now = datetime.now().replace(microsecond=0)
+    start = now - timedelta(days=days)
+    step = days * 86400 / rows
+
+    # The pre-migration layout, filled the way LogEvent used to write it
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE events (level TEXT, event TEXT, timestamp TEXT)")
+    levels = ("Info", "Info", "Info", "Warning", "Error")
+
+    def legacy_rows():
+        for i in range(rows):
+            when = (start + timedelta(seconds=i * step)).strftime(database.EVENT_TIME_FORMAT)
+            yield levels[i % len(levels)], f"Room {i % 7}: item {i % 50} moved", when
+
+    started = time.perf_counter()
+    conn.executemany("INSERT INTO events VALUES (?, ?, ?)", legacy_rows())
+    conn.commit()
+    fill_seconds = time.perf_counter() - started
+
+    window = (now - timedelta(days=database.EVENT_WINDOW_DAYS)).strftime(database.EVENT_TIME_FORMAT)
+    hour_from = (now - timedelta(days=20)).strftime(database.EVENT_TIME_FORMAT)
+    hour_to = (now - timedelta(days=20) + timedelta(hours=1)).strftime(database.EVENT_TIME_FORMAT)
+
+    old_window = timed(lambda: len(conn.execute(
+        "SELECT * FROM events WHERE timestamp >= ?", (window,)).fetchall()))
+    old_hour = timed(lambda: len(conn.execute(
+        "SELECT * FROM events WHERE timestamp >= ? AND timestamp < ?", (hour_from, hour_to)).fetchall()))
+    old_hour_level = timed(lambda: len(conn.execute(
+        "SELECT * FROM events WHERE timestamp >= ? AND timestamp < ? AND level = ?",
+        (hour_from, hour_to, "Warning")).fetchall()))
+    conn.close()
+
+    started = time.perf_counter()
+    database.open_connection(path).close()
+    migrate_seconds = time.perf_counter() - started
+
+    database.DB_FILE = path
+    db = database.DB()
+    new_window = timed(lambda: len(db.get_events(since=window)))
+    new_hour = timed(lambda: len(db.get_events(since=hour_from, until=hour_to)))
+    new_hour_level = timed(lambda: len(db.get_events(since=hour_from, until=hour_to, level="Warning")))
+
+    def compare(old, new):
+        return {
+            "rows": new[1],
+            "text_ms": old[0] * 1000,
+            "indexed_ms": new[0] * 1000,
+            "speedup": old[0] / new[0] if new[0] else None,
+        }
+
+    return {
+        "rows": rows,
+        "fill_seconds": fill_seconds,
+        "migrate_seconds": migrate_seconds,
+        "last_14_days": compare(old_window, new_window),
+        "one_hour": compare(old_hour, new_hour),
+        "one_hour_one_level": compare(old_hour_level, new_hour_level),
+    }
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="database-bench-")
+    cwd = os.getcwd()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    try:
+        import database
+
+        result = {"config": {"events": args.events, "rows": args.rows}}
+        if args.events > 0:
+            if not args.skip_direct:
+                result["direct"] = bench_direct(database, args.events)
+            result["writer"] = bench_writer(database, args.events)
+        if args.rows > 0:
+            result["queries"] = bench_queries(database, args.rows)
+        database.close_writers()
+        return result
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Log.db event writes and queries.")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--skip-direct", action="store_true", help="only run the batched writer")
+    parser.add_argument("--rows", type=int, default=0, help="rows for the query benchmark, 0 = skip it")
+    parser.add_argument("--output", help="write the JSON result here instead of stdout")
+    args = parser.parse_args(argv)
+
+    text = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
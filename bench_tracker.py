@@ -0,0 +1,302 @@
+"""
+Synthetic load benchmark for the tracker ingest path.
+
+Runs tracker.main() against a fake MQTT client and a fake RPi.GPIO module,
+so no broker, ESP32 or Pi is needed. The fake client's loop_forever()
+publishes ESP32-shaped sightings for N rooms x M devices and fires the PIR
+callback at a fixed interval, then returns so main() shuts down normally.
+
+    python bench_tracker.py --rooms 4 --devices 50 --messages 100000
+    python bench_tracker.py --rate 2000 --seconds 10 --batch
+
+Results are printed as JSON on stdout; tracker output goes to stderr.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+
+# ---------------- FAKE HARDWARE ----------------
+class FakeGPIO(types.ModuleType):
+    BCM = "BCM"
+    IN = "IN"
+    RISING = "RISING"
+
+    def __init__(self):
+        super().__init__("RPi.GPIO")
+        self.callbacks = {}
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, mode):
+        pass
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=0):
+        self.callbacks[pin] = callback
+
+    def cleanup(self):
+        self.callbacks.clear()
+
+    def trigger(self, pin):
+        callback = self.callbacks.get(pin)
+        if callback is not None:
+            callback(pin)
+
+
+class FakeMessage:
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeMQTTClient:
+    """
+    Stands in for paho.mqtt.client.Client. loop_forever() runs `load`, a
+    callable that receives a publish(topic, payload) function.
+    """
+
+    load = None
+
+    def __init__(self, *args, **kwargs):
+        self.on_message = None
+        self.subscriptions = []
+
+    def connect(self, host, port=1883, keepalive=60):
+        pass
+
+    def subscribe(self, topic):
+        self.subscriptions.append(topic)
+
+    def publish(self, topic, payload):
+        self.on_message(self, None, FakeMessage(topic, payload))
+
+    def disconnect(self):
+        pass
+
+    def loop_forever(self):
+        if FakeMQTTClient.load is not None:
+            FakeMQTTClient.load(self.publish)
+
+
+def install_fakes():
+    gpio = FakeGPIO()
+    rpi = types.ModuleType("RPi")
+    rpi.GPIO = gpio
+
+    client_module = types.ModuleType("paho.mqtt.client")
+    client_module.Client = FakeMQTTClient
+    mqtt = types.ModuleType("paho.mqtt")
+    mqtt.client = client_module
+    paho = types.ModuleType("paho")
+    paho.mqtt = mqtt
+
+    sys.modules.update({
+        "RPi": rpi,
+        "RPi.GPIO": gpio,
+        "paho": paho,
+        "paho.mqtt": mqtt,
+        "paho.mqtt.client": client_module,
+    })
+    return gpio
+
+
+# ---------------- SYNTHETIC LOAD ----------------
+def device_mac(index):
+    return "02:00:00:00:%02x:%02x" % (index >> 8 & 0xff, index & 0xff)
+
+
+def random_mac(rng):
+    return ":".join("%02x" % rng.randrange(256) for _ in range(6))
+
+
+def make_messages(args, rng):
+    """
+    Yield (topic, payload) pairs, cycling over devices and rooms.
+    """
+    rooms = [f"Room{r}" for r in range(args.rooms)]
+    i = 0
+    while True:
+        room = rooms[i % args.rooms]
+        topic = f"ble/{room.lower()}"
+        if args.batch:
+            items = []
+            for d in range(args.devices):
+                mac = random_mac(rng) if rng.random() < args.unregistered else device_mac(d)
+                items.append({"item": mac, "rssi": rng.randint(-90, -40)})
+            payload = {"room": room, "ts": i, "items": items}
+        else:
+            d = (i // args.rooms) % args.devices
+            mac = random_mac(rng) if rng.random() < args.unregistered else device_mac(d)
+            payload = {"item": mac, "room": room, "rssi": rng.randint(-90, -40)}
+        yield topic, json.dumps(payload).encode()
+        i += 1
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "p50_us": None if not samples else percentile(samples, 50) * 1e6,
+        "p99_us": None if not samples else percentile(samples, 99) * 1e6,
+        "max_us": None if not samples else max(samples) * 1e6,
+    }
+
+
+# ---------------- RUN ----------------
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="tracker-bench-")
+    cwd = os.getcwd()
+    gpio = install_fakes()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    try:
+        import database
+        db = database.DB()
+        for d in range(args.devices):
+            db.add_item(f"Item {d}", "bench", device_mac(d))
+        db.conn.close()
+
+        import tracker
+
+        # The endpoint's shutdown poll would show up in elapsed time
+        tracker.METRICS_PORT = None
+
+        callback_times = []
+        e2e_times = []
+        exit_times = []
+        sightings = [0]
+        processed = [0]
+
+        process_batch = tracker.process_batch
+
+        def timed_process_batch(batch):
+            process_batch(batch)
+            done = time.time()
+            processed[0] += len(batch)
+            for _, received in batch:
+                e2e_times.append(done - received)
+
+        tracker.process_batch = timed_process_batch
+
+        rng = random.Random(args.seed)
+        messages = make_messages(args, rng)
+        per_message = args.devices if args.batch else 1
+        stats = {}
+
+        def load(publish):
+            interval = 1.0 / args.rate if args.rate > 0 else 0.0
+            start = time.perf_counter()
+            deadline = start + args.seconds if args.seconds > 0 else None
+            sent = 0
+            while args.messages <= 0 or sent < args.messages:
+                now = time.perf_counter()
+                if deadline is not None and now >= deadline:
+                    break
+                if interval:
+                    wait = start + sent * interval - now
+                    if wait > 0:
+                        time.sleep(wait)
+
+                topic, payload = next(messages)
+                t0 = time.perf_counter()
+                publish(topic, payload)
+                callback_times.append(time.perf_counter() - t0)
+                sent += 1
+                sightings[0] += per_message
+
+                if args.pir_every and sent % args.pir_every == 0:
+                    t0 = time.perf_counter()
+                    gpio.trigger(tracker.PIR_PIN)
+                    exit_times.append(time.perf_counter() - t0)
+
+            stats["sent"] = sent
+            stats["publish_seconds"] = time.perf_counter() - start
+
+        FakeMQTTClient.load = load
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stderr):
+            tracker.main([])
+        elapsed = time.perf_counter() - start
+        ingest = tracker.ingest_queue.stats()
+
+        return {
+            "config": {
+                "rooms": args.rooms,
+                "devices": args.devices,
+                "rate": args.rate,
+                "batch": args.batch,
+                "unregistered": args.unregistered,
+                "seed": args.seed,
+            },
+            # Throughput is what reached process_batch; published messages may have been dropped
+            "processed": processed[0],
+            "processed_per_second": processed[0] / elapsed if elapsed else None,
+            "processed_sightings_per_second": processed[0] * per_message / elapsed if elapsed else None,
+            "dropped": ingest["dropped"],
+            "coalesced": ingest["coalesced"],
+            "published": stats["sent"],
+            "published_sightings": sightings[0],
+            "published_per_second": stats["sent"] / stats["publish_seconds"] if stats["publish_seconds"] else None,
+            "elapsed_seconds": elapsed,
+            "callback_latency": summarize(callback_times),
+            "end_to_end_latency": summarize(e2e_times),
+            "exit_check_latency": summarize(exit_times),
+            "ingest": ingest,
+            "duplicates": dict(tracker.duplicate_stats),
+            "speculation": tracker.speculator.stats(),
+        }
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print(" Kept work directory:", workdir, file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tracker ingest path with synthetic load.")
+    parser.add_argument("--rooms", type=int, default=4)
+    parser.add_argument("--devices", type=int, default=50, help="registered devices")
+    parser.add_argument("--rate", type=float, default=0, help="messages per second, 0 = as fast as possible")
+    parser.add_argument("--messages", type=int, default=50000, help="stop after this many messages, 0 = no limit")
+    parser.add_argument("--seconds", type=float, default=0, help="stop after this long, 0 = no limit")
+    parser.add_argument("--batch", action="store_true", help="publish one batched scan report per room per cycle")
+    parser.add_argument("--unregistered", type=float, default=0.0, help="fraction of sightings from random MACs")
+    parser.add_argument("--pir-every", type=int, default=1000, help="fire the PIR callback every N messages, 0 = never")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON result here instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary work directory")
+    args = parser.parse_args(argv)
+
+    if args.messages <= 0 and args.seconds <= 0:
+        parser.error("set --messages or --seconds")
+
+    result = run(args)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Record and replay of tracker input.
+
+The tracker records with `python tracker.py --record capture.bin`. A
+capture holds every ble/# message, every PIR edge and every change to the
+registered item set, each with the time it arrived.
+
+    python capture.py capture.bin                # as fast as possible
+    python capture.py capture.bin --speed 1      # real time
+    python capture.py capture.bin --speed 10     # 10x
+
+Replay runs in a scratch directory against fake MQTT/GPIO modules and
+feeds each record through tracker.process_batch / check_missing_items with
+the recorded time, so the exit decisions are the same on every run. The
+result (throughput and every exit decision) is printed as JSON.
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+MAGIC = b"EDCCAP1\n"
+
+# Record types
+MESSAGE = 1
+PIR = 2
+ITEMS = 3
+
+HEADER = struct.Struct("<Bd")      # type, arrival time
+MESSAGE_SIZES = struct.Struct("<HI")  # topic length, payload length
+PIR_PIN = struct.Struct("<H")
+ITEMS_SIZE = struct.Struct("<I")
+
+
+class CaptureWriter:
+    """
+    Appends records to a capture file. Safe to call from the paho and
+    GPIO threads at the same time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.records = 0
+
+    def write_message(self, when, topic, payload):
+        topic = topic.encode() if isinstance(topic, str) else topic
+        payload = payload.encode() if isinstance(payload, str) else payload
+        record = (HEADER.pack(MESSAGE, when)
+                  + MESSAGE_SIZES.pack(len(topic), len(payload)) + topic + payload)
+        self._write(record)
+
+    def write_pir(self, when, pin):
+        self._write(HEADER.pack(PIR, when) + PIR_PIN.pack(pin))
+
+    def write_items(self, when, names):
+        data = json.dumps(names, separators=(",", ":"), sort_keys=True).encode()
+        self._write(HEADER.pack(ITEMS, when) + ITEMS_SIZE.pack(len(data)) + data)
+
+    def _write(self, record):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(record)
+            self.records += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise EOFError
+    return data
+
+
+def read_capture(path):
+    """
+    Yield (type, time, value) per record. value is (topic, payload) for
+    MESSAGE, the pin for PIR and {mac: name} for ITEMS. A record cut short
+    at the end of the file is ignored.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a tracker capture")
+        try:
+            while True:
+                header = f.read(HEADER.size)
+                if not header:
+                    return
+                if len(header) != HEADER.size:
+                    raise EOFError
+                kind, when = HEADER.unpack(header)
+
+                if kind == MESSAGE:
+                    topic_len, payload_len = MESSAGE_SIZES.unpack(_read_exact(f, MESSAGE_SIZES.size))
+                    topic = _read_exact(f, topic_len).decode()
+                    payload = _read_exact(f, payload_len)
+                    yield MESSAGE, when, (topic, payload)
+                elif kind == PIR:
+                    (pin,) = PIR_PIN.unpack(_read_exact(f, PIR_PIN.size))
+                    yield PIR, when, pin
+                elif kind == ITEMS:
+                    (size,) = ITEMS_SIZE.unpack(_read_exact(f, ITEMS_SIZE.size))
+                    yield ITEMS, when, json.loads(_read_exact(f, size))
+                else:
+                    raise ValueError(f"Unknown record type {kind} in {path}")
+        except EOFError:
+            return
+
+
+# ---------------- REPLAY ----------------
+def replay(path, speed=0.0):
+    """
+    Feed a capture through the tracker pipeline. speed 0 runs as fast as
+    possible, 1 in real time, N at N times real time.
+    """
+    from bench_tracker import install_fakes
+
+    path = os.path.abspath(path)
+    workdir = tempfile.mkdtemp(prefix="tracker-replay-")
+    cwd = os.getcwd()
+    install_fakes()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    try:
+        import tracker
+
+        decisions = []
+        messages = 0
+        first = None
+        start = time.perf_counter()
+
+        with contextlib.redirect_stdout(sys.stderr):
+            for kind, when, value in read_capture(path):
+                if first is None:
+                    first = when
+                if speed > 0:
+                    wait = start + (when - first) / speed - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+
+                if kind == MESSAGE:
+                    tracker.process_batch([(value[1], when)])
+                    messages += 1
+                elif kind == PIR:
+                    missing = tracker.check_missing_items(now=when)
+                    decisions.append({"time": when, "missing": sorted(missing)})
+                elif kind == ITEMS:
+                    tracker.set_registered_items(value)
+
+            tracker.journal.close()
+
+        elapsed = time.perf_counter() - start
+        return {
+            "capture": path,
+            "speed": speed,
+            "messages": messages,
+            "elapsed_seconds": elapsed,
+            "messages_per_second": messages / elapsed if elapsed else None,
+            "exit_checks": decisions,
+            "duplicates": dict(tracker.duplicate_stats),
+        }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a tracker capture.")
+    parser.add_argument("capture")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="0 = as fast as possible, 1 = real time, N = N times real time")
+    parser.add_argument("--output", help="write the JSON result here instead of stdout")
+    args = parser.parse_args(argv)
+
+    text = json.dumps(replay(args.capture, args.speed), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
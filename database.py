@@ -1,43 +1,562 @@
 import sqlite3
 import logging
-import log
+import atexit
+import os
+import re
+import threading
+import time
 from datetime import datetime, timedelta
 
+DB_FILE = 'Log.db'
 
-class DB:
-    def __init__(self):
-        self.conn = sqlite3.connect('Log.db')
-        self.cur = self.conn.cursor()
-        self.create_table()
+# Applied to every connection. WAL lets the GUI read while the tracker and
+# relay write, and with WAL synchronous=NORMAL only fsyncs on checkpoints
+PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",     # Wait for another writer instead of failing
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-4000",      # 4 MB page cache
+)
 
-    def create_table(self):
-        # Events table
-        tableExist = self.cur.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name='events';")
-        if not tableExist.fetchone():
-            self.cur.execute(
-                "CREATE TABLE events (level TEXT, event TEXT, timestamp TEXT)")
+SCHEMA_VERSION = 4   # PRAGMA user_version once migrate() has run
 
-        # Users table
-        userTableExist = self.cur.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name='users';")
-        if not userTableExist.fetchone():
-            self.cur.execute(
-                "CREATE TABLE users (username TEXT PRIMARY KEY, password TEXT)")
-        # Items table
-        itemTableExist = self.cur.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name='items';")
-        if not itemTableExist.fetchone():
-            self.cur.execute("""
-               CREATE TABLE items (
+EVENT_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+EVENT_WINDOW_DAYS = 14       # How far back GetEvents looks
+EVENT_PAGE_SIZE = 500        # Rows fetched per query by iter_events
+FTS_MIN_KEYWORD = 3          # Shorter keywords are matched with LIKE, not events_fts
+
+EVENT_BATCH_SIZE = 500       # Write logged events once this many are waiting...
+EVENT_FLUSH_SECONDS = 1.0    # ...or the oldest has waited this long
+
+ROLLUP_MINUTE = 60           # sighting_rollups resolutions, bucket width in seconds
+ROLLUP_HOUR = 3600
+
+MAC_SEPARATORS = re.compile(r"[:\-.]")
+MAC_DIGITS = re.compile(r"[0-9a-f]{12}")
+
+
+def normalize_mac(mac):
+    """
+    Return `mac` as lowercase aa:bb:cc:dd:ee:ff, or None if it isn't a MAC.
+    Accepts any case and ':', '-', '.' or no separators.
+    """
+    if not isinstance(mac, str):
+        return None
+    digits = MAC_SEPARATORS.sub("", mac.strip().lower())
+    if not MAC_DIGITS.fullmatch(digits):
+        return None
+    return ":".join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+def mac_to_int(mac):
+    """
+    Return `mac` as a 48-bit integer, or None if it isn't a MAC.
+    """
+    if not isinstance(mac, str):
+        return None
+    digits = MAC_SEPARATORS.sub("", mac.strip().lower())
+    if not MAC_DIGITS.fullmatch(digits):
+        return None
+    return int(digits, 16)
+
+
+def format_mac(value):
+    """
+    Inverse of mac_to_int: 48-bit integer to aa:bb:cc:dd:ee:ff.
+    """
+    digits = "%012x" % value
+    return ":".join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+# ---------------- CONNECTIONS ----------------
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()   # database paths whose tables were checked by this process
+_fts_ready = {}         # database path -> whether events_fts exists
+
+
+def create_tables(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS items (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT,
             description TEXT,
             mac TEXT
-                 )
-         """)
+        )
+    """)
+    # Bumped by every write to items, so readers can tell it changed from one row
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS items_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)")
+    conn.execute("INSERT OR IGNORE INTO items_version (id, version) VALUES (1, 0)")
+    for op in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS items_version_{op.lower()} AFTER {op} ON items BEGIN
+                UPDATE items_version SET version = version + 1 WHERE id = 1;
+            END
+        """)
+    conn.commit()
+    migrate(conn)
 
-        self.conn.commit()
+
+def migrate(conn):
+    """
+    Bring the events table up to SCHEMA_VERSION.
+
+    Version 1 stores the time as REAL epoch seconds instead of a local
+    time string, indexed on time and on (level, time). Existing rows are
+    converted in one INSERT ... SELECT, so even a large Log.db migrates
+    in a single pass.
+
+    Version 2 marks the switch to incremental auto-vacuum, so pages freed
+    by retention.py can be handed back a few at a time. New files start
+    out that way; an existing file needs a full VACUUM, which is left to
+    `python retention.py --convert` rather than whoever opens it first.
+
+    Version 3 adds events_fts, a trigram FTS5 index over the event text
+    kept in sync by triggers, so keyword filters are substring matches.
+    SQLite builds without FTS5 or the trigram tokenizer (3.34+) skip it
+    and keyword filters fall back to LIKE.
+
+    Version 4 adds the sightings time series: one compact row per stored
+    sighting keyed by (item, time, room), and sighting_rollups holding
+    per-minute and per-hour aggregates of it (see rollup.py).
+    """
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+
+    # Another process may be migrating too; whoever gets the write lock first does it
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(events)")]
+            conn.execute("""
+                CREATE TABLE events_v1 (
+                    id INTEGER PRIMARY KEY,
+                    time REAL NOT NULL,
+                    level TEXT NOT NULL,
+                    event TEXT NOT NULL
+                )
+            """)
+            if "timestamp" in columns:
+                # Old timestamps are local time, 'utc' converts them to epoch seconds
+                conn.execute("""
+                    INSERT INTO events_v1 (time, level, event)
+                    SELECT COALESCE(CAST(strftime('%s', timestamp, 'utc') AS REAL), 0),
+                           COALESCE(level, ''), COALESCE(event, '')
+                    FROM events
+                    ORDER BY 1, rowid
+                """)
+            if columns:
+                conn.execute("DROP TABLE events")
+            conn.execute("ALTER TABLE events_v1 RENAME TO events")
+            conn.execute("CREATE INDEX events_time ON events (time)")
+            conn.execute("CREATE INDEX events_level_time ON events (level, time)")
+            conn.execute("PRAGMA user_version = 1")
+        if version < 2:
+            conn.execute("PRAGMA user_version = 2")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+    if conn.execute("PRAGMA user_version").fetchone()[0] < 3:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < 3:
+                conn.execute(
+                    "CREATE VIRTUAL TABLE events_fts USING fts5(event, content='events', content_rowid='id',"
+                    " tokenize='trigram')")
+                conn.execute("""
+                    CREATE TRIGGER events_fts_insert AFTER INSERT ON events BEGIN
+                        INSERT INTO events_fts (rowid, event) VALUES (new.id, new.event);
+                    END
+                """)
+                conn.execute("""
+                    CREATE TRIGGER events_fts_delete AFTER DELETE ON events BEGIN
+                        INSERT INTO events_fts (events_fts, rowid, event) VALUES ('delete', old.id, old.event);
+                    END
+                """)
+                conn.execute("""
+                    CREATE TRIGGER events_fts_update AFTER UPDATE OF event ON events BEGIN
+                        INSERT INTO events_fts (events_fts, rowid, event) VALUES ('delete', old.id, old.event);
+                        INSERT INTO events_fts (rowid, event) VALUES (new.id, new.event);
+                    END
+                """)
+                conn.execute("INSERT INTO events_fts (events_fts) VALUES ('rebuild')")
+                conn.execute("PRAGMA user_version = 3")
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if "fts5" not in str(e) and "tokenizer" not in str(e):
+                raise
+            # No FTS5 or trigrams in this build; don't try again on every open
+            conn.execute("PRAGMA user_version = 3")
+            conn.commit()
+
+    if conn.execute("PRAGMA user_version").fetchone()[0] < 4:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < 4:
+                conn.execute("CREATE TABLE rooms (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+                # WITHOUT ROWID stores each row once, in key order; "where was
+                # this item between A and B" is a single range scan
+                conn.execute("""
+                    CREATE TABLE sightings (
+                        item_id INTEGER NOT NULL,
+                        room_id INTEGER NOT NULL,
+                        time REAL NOT NULL,
+                        rssi INTEGER,
+                        PRIMARY KEY (item_id, time, room_id)
+                    ) WITHOUT ROWID
+                """)
+                conn.execute("""
+                    CREATE TABLE sighting_rollups (
+                        resolution INTEGER NOT NULL,
+                        item_id INTEGER NOT NULL,
+                        bucket INTEGER NOT NULL,
+                        room_id INTEGER NOT NULL,
+                        count INTEGER NOT NULL,
+                        rssi_min INTEGER,
+                        rssi_max INTEGER,
+                        rssi_sum INTEGER NOT NULL,
+                        rssi_count INTEGER NOT NULL,
+                        dwell REAL NOT NULL,
+                        first_seen REAL NOT NULL,
+                        last_seen REAL NOT NULL,
+                        PRIMARY KEY (resolution, item_id, bucket, room_id)
+                    ) WITHOUT ROWID
+                """)
+                conn.execute("""
+                    CREATE TABLE sighting_rollup_state (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        done_until REAL NOT NULL
+                    )
+                """)
+                conn.execute("PRAGMA user_version = 4")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def has_fts(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='events_fts'").fetchone() is not None
+
+
+def fts_query(keywords):
+    """
+    MATCH expression for events_fts (trigram tokenizer) finding events that
+    contain any of `keywords`, ignoring case. Trigrams need at least three
+    characters, so shorter keywords are left out; None if none are left.
+    """
+    terms = ['"' + keyword.replace('"', '""') + '"' for keyword in keywords
+             if len(keyword) >= FTS_MIN_KEYWORD]
+    return " OR ".join(terms) or None
+
+
+def event_time(value):
+    """
+    Epoch seconds for a number, a datetime or a "YYYY-MM-DD HH:MM:SS"
+    (or ISO 8601) local time string.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+def format_event_time(value):
+    return datetime.fromtimestamp(value).strftime(EVENT_TIME_FORMAT)
+
+
+def open_connection(path, check_same_thread=True):
+    """
+    A new connection to `path` in WAL mode with PRAGMAS applied. The tables
+    are created the first time this process opens `path`.
+    """
+    conn = sqlite3.connect(path, timeout=5, check_same_thread=check_same_thread)
+    # Before anything writes the header, so a new file starts out incremental;
+    # on an older file it does nothing until RetentionJob.convert()'s VACUUM
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+
+    with _schema_lock:
+        if path not in _schema_ready:
+            create_tables(conn)
+            _schema_ready.add(path)
+            _fts_ready[path] = has_fts(conn)
+    return conn
+
+
+def connect(path=None):
+    """
+    The calling thread's connection to `path` (DB_FILE by default), opened
+    on first use and reused after that.
+    """
+    path = os.path.abspath(path or DB_FILE)
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(path)
+    if conn is not None:
+        try:
+            conn.total_changes
+        except sqlite3.ProgrammingError:
+            # Closed by whoever used it last
+            conn = None
+    if conn is None:
+        conn = connections[path] = open_connection(path)
+    return conn
+
+
+# ---------------- WRITERS ----------------
+class BatchWriter:
+    """
+    Writes rows to the database from a background thread.
+
+    write() only appends to a list. The thread hands everything waiting to
+    _insert() in one transaction, once `batch_size` rows are waiting, the
+    oldest has waited `flush_interval` seconds, flush() is called, or on
+    close(). Subclasses say what a row is and how it is inserted.
+    """
+
+    name = "batch-writer"
+
+    def __init__(self, path, batch_size=EVENT_BATCH_SIZE, flush_interval=EVENT_FLUSH_SECONDS):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.cond = threading.Condition()
+        self.pending = []
+        self.first_at = None     # when the oldest pending row was written
+        self.flush_requested = False
+        self.closing = False
+
+        # Counters
+        self.queued = 0
+        self.committed = 0
+        self.batches = 0
+        self.failed = 0
+        self.write_seconds = 0.0
+
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def write_many(self, rows):
+        with self.cond:
+            if self.closing:
+                raise RuntimeError(self.name + " is closed")
+            if not self.pending:
+                self.first_at = time.monotonic()
+            self.pending.extend(rows)
+            self.queued += len(rows)
+            if len(self.pending) >= self.batch_size:
+                self.cond.notify_all()
+
+    def flush(self):
+        """
+        Block until everything written so far is committed.
+        """
+        with self.cond:
+            target = self.queued
+            if self.committed >= target:
+                return
+            self.flush_requested = True
+            self.cond.notify_all()
+            while self.committed < target and self._thread.is_alive():
+                self.cond.wait(1)
+
+    def close(self):
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self._thread.join()
+
+    def _next_batch(self):
+        with self.cond:
+            while True:
+                pending = self.pending
+                if pending and (self.closing or self.flush_requested
+                                or len(pending) >= self.batch_size
+                                or time.monotonic() - self.first_at >= self.flush_interval):
+                    break
+                if self.closing:
+                    return None
+                timeout = None if not pending else self.first_at + self.flush_interval - time.monotonic()
+                self.cond.wait(timeout)
+
+            self.pending = []
+            self.flush_requested = False
+            return pending
+
+    def _insert(self, conn, batch):
+        raise NotImplementedError
+
+    def _run(self):
+        conn = open_connection(self.path)
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+
+                started = time.monotonic()
+                try:
+                    with conn:
+                        self._insert(conn, batch)
+                except sqlite3.Error as e:
+                    print(f" {self.name} could not write {len(batch)} rows:", e)
+                    failed = len(batch)
+                else:
+                    failed = 0
+
+                with self.cond:
+                    self.committed += len(batch)
+                    self.failed += failed
+                    self.batches += 1
+                    self.write_seconds += time.monotonic() - started
+                    self.cond.notify_all()
+        finally:
+            conn.close()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "queued": self.queued,
+                "committed": self.committed - self.failed,
+                "failed": self.failed,
+                "pending": len(self.pending),
+                "batches": self.batches,
+                "write_seconds": self.write_seconds,
+                "rows_per_write_second": (self.committed / self.write_seconds
+                                          if self.write_seconds else None),
+            }
+
+
+class EventWriter(BatchWriter):
+    """
+    Batched inserts into the events table, for DB.LogEvent.
+    """
+
+    name = "event-writer"
+
+    def write(self, level, event, when):
+        self.write_many(((when, level, event),))
+
+    def _insert(self, conn, batch):
+        conn.executemany("INSERT INTO events (time, level, event) VALUES (?, ?, ?)", batch)
+
+
+class SightingWriter(BatchWriter):
+    """
+    Batched inserts into the sightings table. Rows are
+    (item id, room name, epoch seconds, rssi); room names are turned into
+    rooms table ids here, off the caller's thread.
+    """
+
+    name = "sighting-writer"
+
+    def __init__(self, path, **kwargs):
+        self.room_ids = {}   # room name -> rooms.id, only touched by the writer thread
+        super().__init__(path, **kwargs)
+
+    def _insert(self, conn, batch):
+        room_ids = self.room_ids
+        rows = []
+        for item_id, room, when, rssi in batch:
+            room_id = room_ids.get(room)
+            if room_id is None:
+                room_id = room_ids[room] = intern_room(conn, room)
+            rows.append((item_id, room_id, when, rssi))
+        # A repeat of the same (item, time, room) is the same sighting
+        conn.executemany(
+            "INSERT OR IGNORE INTO sightings (item_id, room_id, time, rssi) VALUES (?, ?, ?, ?)", rows)
+
+
+def intern_room(conn, name):
+    """
+    rooms.id for `name`, adding the room if it is new.
+    """
+    conn.execute("INSERT OR IGNORE INTO rooms (name) VALUES (?)", (name,))
+    return conn.execute("SELECT id FROM rooms WHERE name = ?", (name,)).fetchone()[0]
+
+
+_writers = {}   # (writer class, database path) -> writer
+_writers_lock = threading.Lock()
+
+
+def _writer(kind, path):
+    path = os.path.abspath(path or DB_FILE)
+    with _writers_lock:
+        writer = _writers.get((kind, path))
+        if writer is None or writer.closing:
+            writer = _writers[(kind, path)] = kind(path)
+        return writer
+
+
+def event_writer(path=None):
+    """
+    The process-wide EventWriter for `path` (DB_FILE by default).
+    """
+    return _writer(EventWriter, path)
+
+
+def sighting_writer(path=None):
+    """
+    The process-wide SightingWriter for `path` (DB_FILE by default).
+    """
+    return _writer(SightingWriter, path)
+
+
+def _flush(kind, path):
+    path = os.path.abspath(path or DB_FILE)
+    with _writers_lock:
+        writer = _writers.get((kind, path))
+    if writer is not None:
+        writer.flush()
+
+
+def flush_events(path=None):
+    _flush(EventWriter, path)
+
+
+def flush_sightings(path=None):
+    _flush(SightingWriter, path)
+
+
+@atexit.register
+def close_writers():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+class DB:
+    """
+    Queries against Log.db. By default every DB in a thread shares that
+    thread's connection, so creating one is cheap. check_same_thread=False
+    gives a private connection that may be used from several threads, as
+    long as the caller serializes access.
+    """
+
+    def __init__(self, check_same_thread=True):
+        self.path = os.path.abspath(DB_FILE)
+        if check_same_thread:
+            self.conn = connect()
+        else:
+            self.conn = open_connection(self.path, check_same_thread=False)
+        self.cur = self.conn.cursor()
+        self.fts = _fts_ready.get(self.path, False)
 
     def add_item(self, name, desc, mac):
         self.cur.execute(
@@ -45,6 +564,7 @@ class DB:
             (name, desc, mac)
         )
         self.conn.commit()
+        return self.cur.lastrowid
 
     def update_item(self, item_id, name, desc, mac):
         self.cur.execute(
@@ -61,17 +581,220 @@ class DB:
         self.cur.execute("SELECT id, name, description, mac FROM items")
         return self.cur.fetchall()
 
+    def items_version(self):
+        """
+        Counter that goes up with every write to the items table.
+        """
+        return self.cur.execute("SELECT version FROM items_version WHERE id = 1").fetchone()[0]
+
     def LogEvent(self, level, event, timestamp):
-        self.cur.execute(
-            f"INSERT INTO events (level, event, timestamp) VALUES ('{level}', '{event}', '{timestamp}')")
-        self.conn.commit()
+        # Buffered; committed in batches by the EventWriter
+        event_writer(self.path).write(level, event, event_time(timestamp))
+
+    def FlushEvents(self):
+        flush_events(self.path)
 
 # gets all events from the database that are not older then 14 days old
     def GetEvents(self):
-        self.cur.execute(
-            f"SELECT * FROM events WHERE timestamp >= '{(datetime.now() + timedelta(days=-14)).strftime('%Y-%m-%d %H:%M:%S')}'")
+        since = (datetime.now() + timedelta(days=-EVENT_WINDOW_DAYS)).timestamp()
+        return [(level, event, format_event_time(when))
+                for _, when, level, event in self.get_events(since=since)]
+
+    def get_events(self, since=None, until=None, level=None, include=None, exclude=None):
+        """
+        (id, time, level, event) rows with since <= time < until, oldest
+        first. since/until take anything event_time() does; level is one
+        level name or a list of them. Served from the time or (level, time) index.
+
+        include/exclude are keyword lists, like log.keyword_match: a row
+        must match one of `include` and none of `exclude`. They are
+        answered by the events_fts index.
+        """
+        self.FlushEvents()
+        sql, params = self._event_filter(since, until, level, include, exclude)
+        self.cur.execute("SELECT id, time, level, event FROM events" + sql + " ORDER BY time, id", params)
         return self.cur.fetchall()
 
+    def event_page(self, since=None, until=None, level=None, limit=EVENT_PAGE_SIZE,
+                   after_cursor=None, newest_first=False, include=None, exclude=None):
+        """
+        One page of get_events() rows: (rows, cursor). Pass the cursor back
+        as after_cursor for the next page; it is None after the last one.
+
+        Pages are found by keyset on (time, id), so each is an index seek
+        no matter how deep into the history it is.
+        """
+        self.FlushEvents()
+        sql, params = self._event_filter(since, until, level, include, exclude)
+        if after_cursor is not None:
+            sql += " AND " if sql else " WHERE "
+            sql += "(time, id) < (?, ?)" if newest_first else "(time, id) > (?, ?)"
+            params.extend(after_cursor)
+        order = " ORDER BY time DESC, id DESC" if newest_first else " ORDER BY time, id"
+        rows = self.conn.execute(
+            "SELECT id, time, level, event FROM events" + sql + order + " LIMIT ?",
+            params + [limit]).fetchall()
+
+        cursor = None
+        if len(rows) == limit:
+            cursor = (rows[-1][1], rows[-1][0])
+        return rows, cursor
+
+    def iter_events(self, since=None, until=None, level=None, limit=None,
+                    after_cursor=None, newest_first=False, page_size=EVENT_PAGE_SIZE,
+                    include=None, exclude=None):
+        """
+        Stream get_events() rows a page at a time, at most `limit` of them,
+        starting after `after_cursor`. Memory use is one page, and no read
+        transaction is held between pages.
+        """
+        remaining = limit
+        cursor = after_cursor
+        while remaining is None or remaining > 0:
+            size = page_size if remaining is None else min(page_size, remaining)
+            rows, cursor = self.event_page(since, until, level, size, cursor, newest_first, include, exclude)
+            yield from rows
+            if remaining is not None:
+                remaining -= len(rows)
+            if cursor is None:
+                return
+
+    def count_events(self, since=None, until=None, level=None, include=None, exclude=None):
+        self.FlushEvents()
+        sql, params = self._event_filter(since, until, level, include, exclude)
+        return self.cur.execute("SELECT COUNT(*) FROM events" + sql, params).fetchone()[0]
+
+    def search_events(self, include, exclude=None, since=None, until=None, level=None, limit=50):
+        """
+        Up to `limit` events matching `include`, best match first (FTS5
+        bm25), newest first among equals. Keywords events_fts can't rank
+        (short ones, level names) give plain newest first results.
+        """
+        query = None
+        if (self.fts and all(len(keyword) >= FTS_MIN_KEYWORD for keyword in include)
+                and not self._matching_levels(include)):
+            query = fts_query(include)
+        if query is None:
+            rows, _ = self.event_page(since, until, level, limit, newest_first=True,
+                                      include=include, exclude=exclude)
+            return rows
+
+        self.FlushEvents()
+        sql, params = self._event_filter(since, until, level, None, exclude)
+        sql = sql.replace(" WHERE ", " AND ", 1)
+        return self.conn.execute(
+            "SELECT events.id, events.time, events.level, events.event"
+            " FROM events_fts JOIN events ON events.id = events_fts.rowid"
+            " WHERE events_fts MATCH ?" + sql
+            + " ORDER BY events_fts.rank, events.time DESC LIMIT ?",
+            [query] + params + [limit]).fetchall()
+
+    def _keyword_clause(self, keywords):
+        """
+        SQL matching events whose text or level contains any of `keywords`,
+        ignoring case, like log.keyword_match on a logbook line. Text is
+        matched through events_fts where it can, level words become a
+        level IN (...) test. The time part of the line is not matched.
+        """
+        clauses = []
+        params = []
+        short = keywords
+        if self.fts:
+            query = fts_query(keywords)
+            if query is not None:
+                clauses.append("events.id IN (SELECT rowid FROM events_fts WHERE events_fts MATCH ?)")
+                params.append(query)
+            short = [keyword for keyword in keywords if len(keyword) < FTS_MIN_KEYWORD]
+        for keyword in short:
+            escaped = keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            clauses.append("events.event LIKE ? ESCAPE '\\'")
+            params.append("%" + escaped + "%")
+        levels = self._matching_levels(keywords)
+        if levels:
+            clauses.append("events.level IN (%s)" % ",".join("?" * len(levels)))
+            params.extend(levels)
+        return "(" + " OR ".join(clauses) + ")", params
+
+    def _matching_levels(self, keywords):
+        """
+        Levels in the events table that contain any of `keywords`.
+        """
+        keywords = [keyword.lower() for keyword in keywords]
+        levels = []
+        level = ""
+        # One seek per distinct level on the (level, time) index
+        while True:
+            level = self.conn.execute("SELECT MIN(level) FROM events WHERE level > ?", (level,)).fetchone()[0]
+            if level is None:
+                return levels
+            if any(keyword in level.lower() for keyword in keywords):
+                levels.append(level)
+
+    def _event_filter(self, since, until, level, include=None, exclude=None):
+        clauses = []
+        params = []
+        if since is not None:
+            clauses.append("time >= ?")
+            params.append(event_time(since))
+        if until is not None:
+            clauses.append("time < ?")
+            params.append(event_time(until))
+        if level is not None:
+            levels = [level] if isinstance(level, str) else list(level)
+            clauses.append("level IN (%s)" % ",".join("?" * len(levels)))
+            params.extend(levels)
+        if include:
+            clause, values = self._keyword_clause(include)
+            clauses.append(clause)
+            params.extend(values)
+        if exclude:
+            clause, values = self._keyword_clause(exclude)
+            clauses.append("NOT " + clause)
+            params.extend(values)
+        if not clauses:
+            return "", params
+        return " WHERE " + " AND ".join(clauses), params
+
+    def FlushSightings(self):
+        flush_sightings(self.path)
+
+    def sighting_history(self, item_id, since=None, until=None, resolution=ROLLUP_HOUR):
+        """
+        (bucket start, room, count, rssi min, rssi max, rssi avg, dwell
+        seconds) rows for one item, oldest first, read from the
+        `resolution` rollup only. Sightings newer than the last rollup.py
+        pass are not included yet.
+        """
+        sql, params = self._rollup_filter(item_id, since, until, resolution)
+        return self.conn.execute(
+            "SELECT r.bucket, rooms.name, r.count, r.rssi_min, r.rssi_max,"
+            " CAST(r.rssi_sum AS REAL) / NULLIF(r.rssi_count, 0), r.dwell"
+            " FROM sighting_rollups r JOIN rooms ON rooms.id = r.room_id"
+            + sql + " ORDER BY r.bucket, rooms.name", params).fetchall()
+
+    def item_rooms(self, item_id, since=None, until=None, resolution=ROLLUP_HOUR):
+        """
+        Where an item has been: (room, count, dwell seconds, first seen,
+        last seen) per room, longest dwell first, summed from the rollup.
+        """
+        sql, params = self._rollup_filter(item_id, since, until, resolution)
+        return self.conn.execute(
+            "SELECT rooms.name, SUM(r.count), SUM(r.dwell), MIN(r.first_seen), MAX(r.last_seen)"
+            " FROM sighting_rollups r JOIN rooms ON rooms.id = r.room_id"
+            + sql + " GROUP BY r.room_id ORDER BY 3 DESC", params).fetchall()
+
+    def _rollup_filter(self, item_id, since, until, resolution):
+        clauses = ["r.resolution = ?", "r.item_id = ?"]
+        params = [resolution, item_id]
+        if since is not None:
+            # Buckets that overlap since..until
+            clauses.append("r.bucket > ?")
+            params.append(event_time(since) - resolution)
+        if until is not None:
+            clauses.append("r.bucket < ?")
+            params.append(event_time(until))
+        return " WHERE " + " AND ".join(clauses), params
+
     def create_user(self, username, password):
         try:
             # In a real app, hash password here!
@@ -0,0 +1,111 @@
+import threading
+from collections import deque
+
+# Overflow policies
+DROP_OLDEST = "drop-oldest"  # full queue: discard the oldest queued message
+COALESCE = "coalesce"        # a newer message for a queued MAC replaces it; full queue: drop oldest
+BLOCK = "block"              # full queue: the producer waits for room
+
+
+class IngestQueue:
+    """
+    Bounded hand-off between the MQTT network thread and the worker.
+
+    put() is called from the paho callback and never does I/O.
+    get_batch() hands the worker everything queued since its last wakeup.
+    """
+
+    def __init__(self, maxsize=1000, policy=DROP_OLDEST):
+        if policy not in (DROP_OLDEST, COALESCE, BLOCK):
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.cond = threading.Condition()
+        self.items = deque()
+        self.pending = {}   # key -> queued [key, item] entry, COALESCE only
+        self.closed = False
+
+        # Counters
+        self.enqueued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    def put(self, item, key=None):
+        """
+        Queue `item`. Returns False if the queue has been closed.
+        """
+        with self.cond:
+            if self.closed:
+                return False
+
+            if self.policy == COALESCE and key is not None:
+                entry = self.pending.get(key)
+                if entry is not None:
+                    entry[1] = item
+                    self.coalesced += 1
+                    return True
+
+            if len(self.items) >= self.maxsize:
+                if self.policy == BLOCK:
+                    while len(self.items) >= self.maxsize and not self.closed:
+                        self.cond.wait()
+                    if self.closed:
+                        return False
+                else:
+                    old_key, _ = self.items.popleft()
+                    if old_key is not None:
+                        self.pending.pop(old_key, None)
+                    self.dropped += 1
+
+            entry = [key, item]
+            self.items.append(entry)
+            if self.policy == COALESCE and key is not None:
+                self.pending[key] = entry
+
+            self.enqueued += 1
+            if len(self.items) > self.max_depth:
+                self.max_depth = len(self.items)
+            self.cond.notify_all()
+            return True
+
+    def get_batch(self, timeout=None):
+        """
+        Wait for at least one item and return everything queued, oldest first.
+        Returns an empty list on timeout, and None once closed and drained.
+        """
+        with self.cond:
+            if not self.items:
+                if self.closed:
+                    return None
+                self.cond.wait(timeout)
+                if not self.items:
+                    return None if self.closed else []
+
+            batch = [item for _, item in self.items]
+            self.items.clear()
+            self.pending.clear()
+            # Wake producers waiting under BLOCK
+            self.cond.notify_all()
+            return batch
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __len__(self):
+        return len(self.items)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "depth": len(self.items),
+                "max_depth": self.max_depth,
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+            }
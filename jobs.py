@@ -0,0 +1,79 @@
+"""
+Shared plumbing for the periodic maintenance jobs on Log.db
+(retention.RetentionJob, rollup.SightingRollup).
+"""
+import sqlite3
+import threading
+import time
+
+# ---------------- CONFIG ----------------
+PRUNE_BATCH = 500               # Rows deleted per transaction
+PRUNE_PAUSE_SECONDS = 0.05      # Gap between batches for other writers
+# ----------------------------------------
+
+
+class BackgroundJob:
+    """
+    Calls run_once() every `interval` seconds on its own thread after
+    start(). Subclasses set `name` (the thread name) and `label` (used in
+    the message printed when a run fails) and implement run_once().
+    """
+
+    name = "background-job"
+    label = "Background job"
+
+    def __init__(self, interval, batch_size=PRUNE_BATCH, pause=PRUNE_PAUSE_SECONDS):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        raise NotImplementedError
+
+    def batches(self, conn, step):
+        """
+        Run `step(limit)` in its own transaction until it handles fewer
+        than batch_size rows or the job is stopped, pausing in between so
+        other writers get a turn. Returns the total it reported.
+        """
+        total = 0
+        while not self._stop.is_set():
+            with conn:
+                count = step(self.batch_size)
+            total += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.pause)
+        return total
+
+    def delete_batches(self, conn, table, key, condition, params):
+        """
+        Delete the rows of `table` matching `condition` in batches, picking
+        each batch by its primary `key` columns. Returns the number deleted.
+        """
+        sql = (f"DELETE FROM {table} WHERE ({key}) IN"
+               f" (SELECT {key} FROM {table} WHERE {condition} LIMIT ?)")
+        return self.batches(conn, lambda limit: conn.execute(sql, (*params, limit)).rowcount)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except (sqlite3.Error, OSError) as e:
+                print(f" {self.label} failed:", e)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
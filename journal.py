@@ -0,0 +1,141 @@
+import json
+import os
+import re
+import threading
+import time
+
+# fsync policies
+FSYNC_ALWAYS = "always"      # fsync after every append
+FSYNC_INTERVAL = "interval"  # fsync at most once every `fsync_interval` seconds
+FSYNC_NEVER = "never"        # leave it to the OS (and close/rotate)
+
+SEGMENT_PATTERN = re.compile(r"^events-(\d+)\.jsonl$")
+
+
+def segment_name(seq):
+    return f"events-{seq:06d}.jsonl"
+
+
+def list_segments(directory):
+    """
+    Return (seq, path) for every journal segment in `directory`, oldest first.
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+
+    segments = []
+    for name in names:
+        match = SEGMENT_PATTERN.match(name)
+        if match:
+            segments.append((int(match.group(1)), os.path.join(directory, name)))
+    segments.sort()
+    return segments
+
+
+class EventJournal:
+    """
+    Append-only JSON Lines event log split into numbered segments.
+
+    A new segment is started once the current one is larger than
+    `max_bytes` or older than `max_age` seconds. Appending never reads
+    back what is already on disk.
+    """
+
+    def __init__(self, directory, max_bytes=8 * 1024 * 1024, max_age=24 * 60 * 60,
+                 fsync=FSYNC_INTERVAL, fsync_interval=1.0):
+        if fsync not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+
+        self.file = None
+        self.seq = 0
+        self.size = 0
+        self.opened_at = 0.0
+        self.last_sync = 0.0
+
+        os.makedirs(directory, exist_ok=True)
+        segments = list_segments(directory)
+        if segments:
+            # Never append to a segment left behind by a previous run, its
+            # last line may be torn
+            self.seq = segments[-1][0]
+
+    def _open_next(self):
+        self.seq += 1
+        path = os.path.join(self.directory, segment_name(self.seq))
+        self.file = open(path, "a", encoding="utf-8")
+        self.size = 0
+        self.opened_at = time.monotonic()
+        self.last_sync = self.opened_at
+
+    def _close_current(self):
+        if self.file is None:
+            return
+        self.file.flush()
+        if self.fsync != FSYNC_NEVER:
+            os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+
+    def _sync(self, force=False):
+        if self.fsync == FSYNC_NEVER:
+            return
+        self.file.flush()
+        now = time.monotonic()
+        if force or self.fsync == FSYNC_ALWAYS or now - self.last_sync >= self.fsync_interval:
+            os.fsync(self.file.fileno())
+            self.last_sync = now
+
+    def append(self, entry):
+        self.append_many((entry,))
+
+    def append_many(self, entries):
+        data = "".join(json.dumps(e, separators=(",", ":")) + "\n" for e in entries)
+        if not data:
+            return
+
+        with self.lock:
+            if self.file is None:
+                self._open_next()
+            elif (self.size >= self.max_bytes
+                  or time.monotonic() - self.opened_at >= self.max_age):
+                self._close_current()
+                self._open_next()
+
+            self.file.write(data)
+            self.size += len(data)
+            self._sync()
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self._sync(force=True)
+
+    def close(self):
+        with self.lock:
+            self._close_current()
+
+
+def iter_events(directory):
+    """
+    Stream every event in the journal, oldest first, one line at a time.
+
+    A torn line at the end of a segment (crash mid-write) is skipped.
+    """
+    for _, path in list_segments(directory):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
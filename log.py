@@ -38,10 +38,13 @@ class DBHandler(logging.Handler):
 
 
     def emit(self, record):
-        when = datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S")
         label = LevelLabels.get(record.levelname, record.levelname.title())
         message = record.getMessage()
-        self.db.LogEvent(label, message, when)
+        self.db.LogEvent(label, message, record.created)
+
+    def flush(self):
+        # LogEvent only queues, make sure the records reached the database
+        self.db.FlushEvents()
 
 # class JsonFormatter(logging.Formatter):
 #     def format(self, record: logging.LogRecord) -> str:
@@ -243,7 +246,6 @@ def keyword_match(message: str, include: Sequence[str], exclude: Sequence[str])
 # if __name__ == "__main__":
 #     LogApp().run()
 
-# worrk on making it stay for 14 days rather than  on launch 
 #remember to commit everything to github
 
 # | level | room   | event    | timestamp |
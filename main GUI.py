@@ -10,10 +10,15 @@ from kivy.graphics import Color, RoundedRectangle, Line
 from kivy.metrics import dp
 from kivy.uix.scrollview import ScrollView
 from kivy.uix.gridlayout import GridLayout
+from kivy.clock import Clock
+import json
 import log
 import database
+from registry import ItemRegistry
+from retention import RetentionJob
 import logging
 from pathlib import Path
+from datetime import datetime, timedelta
 from kivy.uix.scrollview import ScrollView
 
 
@@ -33,8 +38,13 @@ THEME = {
 
 Window.clearcolor = THEME["background"]
 
+LOGBOOK_PAGE_SIZE = 200   # Events loaded per "Load older" press
+HOMES_STATUS_FILE = "status.json"   # Written by sharded.py
+HOMES_REFRESH_SECONDS = 2           # sharded.py rewrites it about this often
+
 # --- Global List ---
 items_list = []
+registry = ItemRegistry()   # Shared with tracker.py through Log.db
 
 # --- UI  ---
 
@@ -391,9 +401,9 @@ class AddItemScreen(Screen):
         desc = self.item_desc.text.strip()
         mac = self.item_mac.text.strip()
         if name:
-            db = database.DB()
-            db.add_item(name, desc, mac)
+            item_id = registry.add_item(name, desc, mac)
             items_list.append({
+                "id": item_id,
                 "name": name,
                 "desc": desc,
                 "mac": mac
@@ -487,12 +497,12 @@ class EditItemScreen(Screen):
         desc = self.item_desc.text.strip()
         mac = self.item_mac.text.strip()
         if self.edit_index is not None and name:
-            db = database.DB()
             item_id = items_list[self.edit_index]["id"]
             # Update in database
-            db.update_item(item_id, name, desc, mac)
+            registry.update_item(item_id, name, desc, mac)
 
             items_list[self.edit_index] = {
+                "id": item_id,
                 "name": name,
                 "desc": desc,
                 "mac": mac
@@ -502,9 +512,8 @@ class EditItemScreen(Screen):
 
     def delete_item(self, instance):
         if self.edit_index is not None:
-            db = database.DB()
             item_id = items_list[self.edit_index]["id"]
-            db.delete_item(item_id)
+            registry.delete_item(item_id)
             items_list.pop(self.edit_index)
             self.manager.get_screen('main').update_items_list()
             self.cancel(instance)
@@ -545,9 +554,15 @@ class LogbookScreen(Screen):
         root.add_widget(scroll)
 
         DB = database.DB()
+        self.DB = DB
+        self.label = label
+        # Oldest event shown so far, "Load older" continues from here
+        self.cursor = None
+        self.since = (datetime.now() - timedelta(days=database.EVENT_WINDOW_DAYS)).timestamp()
 
         # UI handler: friendly text
-        if len(DB.GetEvents()) == 0:
+        if DB.count_events(since=self.since, include=self.IncludeKeywords,
+                           exclude=self.ExcludeKeywords) == 0:
             label.text = "No log events found."
         else:
             label.text = ""
@@ -569,16 +584,8 @@ class LogbookScreen(Screen):
         self.logger.addHandler(UIHandler)
         self.logger.addHandler(log.DBHandler(DB))
 
-        # pull everything from db
-        events = DB.GetEvents()
-        lenEvents = len(events)
-        for index, row in enumerate(events):
-            level, event, timestamp = row
-            message = f"{timestamp} : {level} : {event}"
-            if log.keyword_match(message, self.IncludeKeywords, self.ExcludeKeywords):
-                label.text += message
-                if index <= lenEvents - 2:
-                    label.text += "\n"
+        # Newest page from the db, older pages on demand
+        self.load_older()
 
         # Example logs (you can remove these in production)
         self.logger.info("Bedroom: motion detected")
@@ -595,6 +602,82 @@ class LogbookScreen(Screen):
             height=dp(60)
         ))
 
+        # Load Older Button
+        self.older_btn = ProButton(
+            text="Load older", bg_color=THEME["surface"], size_hint_y=None, height=dp(50))
+        self.older_btn.color = THEME["text_primary"]
+        self.older_btn.disabled = self.cursor is None
+        self.older_btn.bind(on_release=lambda instance: self.load_older())
+        root.add_widget(self.older_btn)
+
+        # Back Button
+        back_btn = ProButton(
+            text="Back", bg_color=THEME["surface"], size_hint_y=None, height=dp(50))
+        back_btn.color = THEME["text_primary"]
+        back_btn.bind(on_release=self.go_back)
+        root.add_widget(back_btn)
+
+        self.add_widget(root)
+
+    def load_older(self):
+        """
+        Put the next LOGBOOK_PAGE_SIZE older events above what is shown.
+        """
+        # Keyword filtering happens in the database (events_fts)
+        rows, self.cursor = self.DB.event_page(
+            since=self.since, limit=LOGBOOK_PAGE_SIZE, after_cursor=self.cursor, newest_first=True,
+            include=self.IncludeKeywords, exclude=self.ExcludeKeywords)
+        lines = [f"{database.format_event_time(when)} : {level} : {event}"
+                 for _, when, level, event in reversed(rows)]
+        if lines:
+            self.label.text = "\n".join(lines + ([self.label.text] if self.label.text else []))
+        if hasattr(self, "older_btn"):
+            self.older_btn.disabled = self.cursor is None
+
+    def update_height(self, instance, value):
+        instance.height = value[1]
+
+    def update_width(self, instance, width):
+        instance.text_size = (width, None)
+
+    def go_back(self, instance):
+        self.manager.current = 'main'
+
+
+class HomesScreen(Screen):
+    """
+    Merged status of every home served by sharded.py, re-read from
+    HOMES_STATUS_FILE while the screen is shown.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        root = BoxLayout(orientation='vertical',
+                         padding=dp(30), spacing=dp(20))
+
+        # Header
+        root.add_widget(Label(
+            text="Homes",
+            font_size=dp(28),
+            bold=True,
+            color=THEME["text_primary"],
+            size_hint_y=None,
+            height=dp(60)
+        ))
+
+        # Status Display
+        self.label = Label(text="",
+                           font_size=dp(18),
+                           color=THEME["text_secondary"],
+                           size_hint_y=None,
+                           halign='left',
+                           valign='top')
+        self.label.bind(texture_size=self.update_height)
+        self.label.bind(width=self.update_width)
+        scroll = ScrollView(size_hint=(1, 1))
+        scroll.add_widget(self.label)
+        root.add_widget(scroll)
+
         # Back Button
         back_btn = ProButton(
             text="Back", bg_color=THEME["surface"], size_hint_y=None, height=dp(50))
@@ -603,6 +686,50 @@ class LogbookScreen(Screen):
         root.add_widget(back_btn)
 
         self.add_widget(root)
+        self.refresh_event = None
+
+    def on_enter(self, *args):
+        self.refresh()
+        self.refresh_event = Clock.schedule_interval(lambda dt: self.refresh(), HOMES_REFRESH_SECONDS)
+
+    def on_leave(self, *args):
+        if self.refresh_event is not None:
+            self.refresh_event.cancel()
+            self.refresh_event = None
+
+    def refresh(self):
+        try:
+            with open(HOMES_STATUS_FILE, "r") as f:
+                status = json.load(f)
+        except FileNotFoundError:
+            self.label.text = "No home status yet. It appears once sharded.py is running."
+            return
+        except (OSError, ValueError) as e:
+            self.label.text = f"Could not read {HOMES_STATUS_FILE}: {e}"
+            return
+        self.label.text = "\n".join(self.format_status(status))
+
+    def format_status(self, status):
+        lines = []
+        for home, home_status in sorted(status.get("homes", {}).items()):
+            lines.append(f"{home}  (updated {datetime.fromtimestamp(home_status['updated']):%H:%M:%S})")
+            for name, item in sorted(home_status["items"].items()):
+                if item["last_seen"] is None:
+                    lines.append(f"    {name}: never seen")
+                else:
+                    seen = datetime.fromtimestamp(item["last_seen"])
+                    lines.append(f"    {name}: {item['room']} at {seen:%Y-%m-%d %H:%M:%S}")
+            if not home_status["items"]:
+                lines.append("    No registered items")
+            missing = home_status["missing"]
+            lines.append("    Missing: " + (", ".join(missing) if missing else "none"))
+            lines.append("")
+
+        router = status.get("router", {})
+        if router:
+            lines.append(f"Routed {router['routed']}, unroutable {router['unroutable']},"
+                         f" dropped {router['dropped']}, worker restarts {router['restarts']}")
+        return lines or ["No homes reported yet."]
 
     def update_height(self, instance, value):
         instance.height = value[1]
@@ -697,8 +824,8 @@ class MainScreen(Screen):
         self.scroll = ScrollView(size_hint=(1, 1), do_scroll_x=False)
         self.items_grid = GridLayout(cols=1, spacing=dp(
             15), size_hint_y=None, padding=[dp(20), dp(10)])
-        db = database.DB()
-        for row in db.get_items():
+        registry.refresh(force=True)
+        for row in registry.get_items():
             item_id, name, desc, mac = row
             items_list.append({
                 "id": item_id,
@@ -740,6 +867,7 @@ class MainScreen(Screen):
         actions = [
             ("Add", self.go_add),
             ("Logbook", self.go_logbook),
+            ("Homes", self.go_homes),
             ("Settings", self.go_settings)
         ]
 
@@ -810,6 +938,10 @@ class MainScreen(Screen):
         self.manager.transition.direction = 'left'
         self.manager.current = 'logbook'
 
+    def go_homes(self, instance):
+        self.manager.transition.direction = 'left'
+        self.manager.current = 'homes'
+
     def go_settings(self, instance):
         self.manager.transition.direction = 'left'
         self.manager.current = 'settings'
@@ -828,9 +960,18 @@ class EverydayCarryApp(App):
         sm.add_widget(AddItemScreen(name='add_item'))
         sm.add_widget(EditItemScreen(name='edit_item'))
         sm.add_widget(LogbookScreen(name='logbook'))
+        sm.add_widget(HomesScreen(name='homes'))
         sm.add_widget(SettingsScreen(name='settings'))
         return sm
 
+    def on_start(self):
+        # Keeps the events table to its retention window while the app runs
+        self.retention = RetentionJob()
+        self.retention.start()
+
+    def on_stop(self):
+        self.retention.stop()
+
 
 if __name__ == "__main__":
     EverydayCarryApp().run()
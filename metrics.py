@@ -0,0 +1,152 @@
+"""
+Counters, gauges and latency histograms in the Prometheus text format.
+
+Everything here is cheap enough to leave on: a histogram observation is a
+bisect over a short tuple plus two additions, and counters are plain ints.
+Updates are not locked; each metric is written from one thread, and a
+scrape only reads.
+
+    curl http://localhost:9108/metrics
+"""
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds, 10 us to 10 s
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # last slot is +Inf
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    A set of metric families rendered together.
+
+    Histograms and counters are owned here; anything that already keeps
+    its own numbers (queue stats, allowlist counters) is registered with a
+    `read` callable that is only called when rendering.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = {}   # name -> (type, help, {labels: metric or callable})
+
+    def _family(self, name, kind, help):
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = (kind, help, {})
+            elif family[0] != kind:
+                raise ValueError(f"{name} is already a {family[0]}")
+            return family[2]
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, **labels):
+        series = self._family(name, "histogram", help)
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(buckets)
+        return histogram
+
+    def counter(self, name, help, read=None, **labels):
+        series = self._family(name, "counter", help)
+        key = tuple(sorted(labels.items()))
+        if read is not None:
+            series[key] = read
+            return None
+        counter = series.get(key)
+        if counter is None:
+            counter = series[key] = Counter()
+        return counter
+
+    def gauge(self, name, help, read, **labels):
+        self._family(name, "gauge", help)[tuple(sorted(labels.items()))] = read
+
+    def render(self):
+        with self.lock:
+            families = [(name, kind, help, list(series.items()))
+                        for name, (kind, help, series) in self.families.items()]
+
+        lines = []
+        for name, kind, help, series in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in series:
+                if kind == "histogram":
+                    cumulative = 0
+                    counts = list(metric.counts)
+                    for bound, count in zip(metric.bounds + (float("inf"),), counts):
+                        cumulative += count
+                        le = _format_labels(labels + (("le", _format_value(bound)),))
+                        lines.append(f"{name}_bucket{le} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(metric.total)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+                else:
+                    value = metric.value if isinstance(metric, Counter) else metric()
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# ---------------- ENDPOINT ----------------
+def serve(metrics, host="127.0.0.1", port=9108):
+    """
+    Serve metrics.render() at http://host:port/metrics from a daemon
+    thread. Returns the server; call shutdown() on it to stop.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
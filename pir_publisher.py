@@ -0,0 +1,57 @@
+"""
+Publishes front door PIR edges to the broker for sharded.py.
+
+In sharded mode the trackers run next to the router, not on the Pi wired
+to the sensor, so each home runs this on that Pi instead; every rising
+edge becomes a message on pir/<home>.
+
+    python pir_publisher.py --home home1 [--broker host]
+"""
+import argparse
+import json
+import time
+
+import paho.mqtt.client as mqtt
+import RPi.GPIO as GPIO
+
+# ---------------- CONFIG ----------------
+MQTT_BROKER = "localhost"
+PIR_PIN = 17
+PIR_QOS = 1     # Exit checks should survive a broker hiccup
+# ----------------------------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish front door PIR edges for sharded.py.")
+    parser.add_argument("--home", required=True, help="home name, as used in the ble/<home>/<room> topics")
+    parser.add_argument("--broker", default=MQTT_BROKER)
+    parser.add_argument("--pin", type=int, default=PIR_PIN)
+    args = parser.parse_args(argv)
+
+    topic = f"pir/{args.home}"
+    client = mqtt.Client()
+    client.connect(args.broker, 1883, 60)
+    client.loop_start()
+
+    def pir_callback(channel):
+        # The router stamps the edge when it arrives; this is only for reference
+        client.publish(topic, json.dumps({"time": time.time()}), qos=PIR_QOS)
+
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(args.pin, GPIO.IN)
+    GPIO.add_event_detect(args.pin, GPIO.RISING, callback=pir_callback, bouncetime=3000)
+
+    print(f" Publishing PIR edges to {topic}...")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        GPIO.cleanup()
+
+
+if __name__ == "__main__":
+    main()
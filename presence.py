@@ -0,0 +1,143 @@
+from array import array
+
+
+class PresenceEngine:
+    """
+    Smoothed, hysteresis-stable room assignment per MAC.
+
+    Rooms are small integer ids (see state.RoomTable), so a room is just
+    an offset into the arrays.
+
+    Every (device, room) pair owns a fixed-size ring of recent RSSI
+    readings inside one flat array, plus a running sum so the mean is O(1).
+    All storage is allocated up front; update() only writes into it.
+
+    A device moves to a new room once that room's mean RSSI beats the
+    current room's by `hysteresis_db`, or the current room has gone quiet
+    for `stale_seconds`.
+    """
+
+    def __init__(self, max_devices=256, max_rooms=16, window=8,
+                 hysteresis_db=6, min_samples=2, stale_seconds=30):
+        self.max_devices = max_devices
+        self.max_rooms = max_rooms
+        self.window = window
+        self.hysteresis_db = hysteresis_db
+        self.min_samples = min_samples
+        self.stale_seconds = stale_seconds
+
+        self.devices = {}   # mac -> device index
+        self.room_count = 0
+
+        cells = max_devices * max_rooms
+        self.rssi = array("h", bytes(2 * cells * window))
+        self.count = array("H", bytes(2 * cells))
+        self.head = array("H", bytes(2 * cells))
+        self.total = array("l", [0]) * cells
+        self.updated = array("d", [0.0]) * cells
+        self.current = array("h", [-1]) * max_devices
+
+        # Counters
+        self.updates = 0
+        self.switches = 0
+        self.overflow = 0
+
+    def _device(self, mac):
+        d = self.devices.get(mac)
+        if d is None:
+            if len(self.devices) >= self.max_devices:
+                return None
+            d = self.devices[mac] = len(self.devices)
+        return d
+
+    def update(self, mac, room, rssi, now):
+        """
+        Record one reading and return the room id `mac` is currently assigned to.
+        """
+        d = self._device(mac)
+        if d is None or room >= self.max_rooms:
+            # Out of preallocated space, fall back to the raw room
+            self.overflow += 1
+            return room
+
+        if room >= self.room_count:
+            self.room_count = room + 1
+
+        self.updates += 1
+        window = self.window
+        cell = d * self.max_rooms + room
+
+        # A room that went quiet starts over instead of averaging old readings
+        if now - self.updated[cell] > self.stale_seconds:
+            self.count[cell] = 0
+            self.total[cell] = 0
+            self.head[cell] = 0
+
+        pos = cell * window + self.head[cell]
+        if self.count[cell] == window:
+            self.total[cell] -= self.rssi[pos]
+        else:
+            self.count[cell] += 1
+        self.rssi[pos] = rssi
+        self.total[cell] += rssi
+        self.head[cell] = (self.head[cell] + 1) % window
+        self.updated[cell] = now
+
+        return self._assign(d, now)
+
+    def _mean(self, cell, now):
+        n = self.count[cell]
+        if n < self.min_samples or now - self.updated[cell] > self.stale_seconds:
+            return None
+        return self.total[cell] / n
+
+    def _assign(self, d, now):
+        base = d * self.max_rooms
+        best = -1
+        best_mean = None
+        for r in range(self.room_count):
+            mean = self._mean(base + r, now)
+            if mean is not None and (best_mean is None or mean > best_mean):
+                best, best_mean = r, mean
+
+        current = self.current[d]
+        if best < 0:
+            # Not enough readings anywhere yet, keep what we had or take the
+            # room that was just heard
+            if current < 0:
+                current = self.current[d] = self._latest(base)
+            return current
+
+        if current < 0:
+            self.current[d] = best
+            return best
+
+        if best != current:
+            current_mean = self._mean(base + current, now)
+            if current_mean is None or best_mean >= current_mean + self.hysteresis_db:
+                self.current[d] = best
+                self.switches += 1
+                return best
+        return current
+
+    def _latest(self, base):
+        latest = 0
+        for r in range(1, self.room_count):
+            if self.updated[base + r] > self.updated[base + latest]:
+                latest = r
+        return latest
+
+    def room_of(self, mac):
+        d = self.devices.get(mac)
+        if d is None or self.current[d] < 0:
+            return None
+        return self.current[d]
+
+    def stats(self):
+        return {
+            "devices": len(self.devices),
+            "rooms": self.room_count,
+            "updates": self.updates,
+            "switches": self.switches,
+            "overflow": self.overflow,
+        }
@@ -0,0 +1,90 @@
+import threading
+
+import database
+
+
+class ItemRegistry:
+    """
+    Cached copy of the items table, shared by the GUI and the tracker.
+
+    Items are kept in memory and indexed by id and normalized MAC. Writes
+    made through the registry update the cache straight away; writes from
+    another process are picked up by refresh(), which only re-reads the
+    table when the trigger-maintained items_version counter has moved.
+    `generation` goes up every time the cache is reloaded, so callers can
+    tell whether anything happened since they last looked.
+    """
+
+    def __init__(self, db=None):
+        self.lock = threading.Lock()
+        self._db = db
+        self.version = None   # items_version the cache was loaded at
+        self.generation = 0
+        self.items = []      # (id, name, description, mac) rows
+        self.by_id = {}
+        self.by_mac = {}     # normalized mac -> row
+
+    @property
+    def db(self):
+        if self._db is None:
+            # The tracker calls in from more than one thread, always under self.lock
+            self._db = database.DB(check_same_thread=False)
+        return self._db
+
+    def _load(self):
+        # Called with the lock held. The counter is read first, so a write
+        # landing in between only costs one extra reload.
+        self.version = self.db.items_version()
+        rows = self.db.get_items()
+        self.items = rows
+        self.by_id = {row[0]: row for row in rows}
+        self.by_mac = {}
+        for row in rows:
+            mac = database.normalize_mac(row[3])
+            if mac is not None:
+                self.by_mac[mac] = row
+        self.generation += 1
+
+    def refresh(self, force=False):
+        """
+        Re-read the items table if it was written since the last load.
+        Returns True if it was reloaded (always when `force` is set).
+        """
+        with self.lock:
+            if not force and self.db.items_version() == self.version:
+                return False
+            self._load()
+            return True
+
+    # ---------------- READS ----------------
+    def get_items(self):
+        return list(self.items)
+
+    def get(self, item_id):
+        return self.by_id.get(item_id)
+
+    def find_mac(self, mac):
+        return self.by_mac.get(database.normalize_mac(mac))
+
+    def names_by_mac(self):
+        """
+        {normalized mac: item name} for every item with a valid MAC.
+        """
+        return {mac: row[1] for mac, row in self.by_mac.items()}
+
+    # ---------------- WRITES ----------------
+    def add_item(self, name, desc, mac):
+        with self.lock:
+            item_id = self.db.add_item(name, desc, mac)
+            self._load()
+            return item_id
+
+    def update_item(self, item_id, name, desc, mac):
+        with self.lock:
+            self.db.update_item(item_id, name, desc, mac)
+            self._load()
+
+    def delete_item(self, item_id):
+        with self.lock:
+            self.db.delete_item(item_id)
+            self._load()
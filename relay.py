@@ -6,6 +6,7 @@ import os
 app = Flask(__name__)
 
 ALERT_LOG_FILE = "alerts.json"
+STATUS_FILE = "status.json"   # Written by sharded.py
 
 
 def save_alert(alert_data):
@@ -65,6 +66,19 @@ def get_alerts():
         return jsonify([]), 200
 
 
+@app.route("/homes", methods=["GET"])
+def get_homes():
+    """
+    Merged item status of every home, as written by sharded.py.
+    """
+    if os.path.exists(STATUS_FILE):
+        with open(STATUS_FILE, "r") as f:
+            status = json.load(f)
+        return jsonify(status), 200
+    else:
+        return jsonify({"homes": {}}), 200
+
+
 @app.route("/status", methods=["GET"])
 def status():
     return jsonify({"system": "running"}), 200
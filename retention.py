@@ -0,0 +1,188 @@
+"""
+Retention for the events table in Log.db.
+
+Events older than their level's retention period are deleted in small
+batches, each in its own short transaction, so the GUI and the loggers
+are never locked out for long. Freed pages are returned to the file
+system with PRAGMA incremental_vacuum, also a few at a time. A Log.db
+created before incremental auto-vacuum needs one full VACUUM first; that
+rewrites the whole file, so it only runs when asked for with --convert,
+never from the GUI's background job.
+
+The GUI runs this in the background; it can also be run by hand:
+
+    python retention.py            # one full pass
+    python retention.py --archive old_events.jsonl
+    python retention.py --convert  # once, with the GUI and tracker stopped
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+import database
+from jobs import BackgroundJob, PRUNE_BATCH, PRUNE_PAUSE_SECONDS
+
+# ---------------- CONFIG ----------------
+RETENTION_DAYS = {      # Per level; levels not listed use DEFAULT_RETENTION_DAYS
+    "Critical": 90,
+    "Error": 30,
+}
+DEFAULT_RETENTION_DAYS = database.EVENT_WINDOW_DAYS
+VACUUM_PAGES = 200              # Pages released per incremental_vacuum step
+RETENTION_INTERVAL_SECONDS = 60 * 60
+# ----------------------------------------
+
+
+class RetentionJob(BackgroundJob):
+    """
+    Deletes expired events and shrinks Log.db, once per `interval`
+    seconds after start(), or on demand with run_once().
+
+    If `archive_path` is set, every deleted event is first appended there
+    as a JSON line. With `convert` set, a file that is not incremental yet
+    gets its full VACUUM; otherwise its free pages are left alone.
+    """
+
+    name = "event-retention"
+    label = "Event retention"
+
+    def __init__(self, retention_days=None, default_days=DEFAULT_RETENTION_DAYS,
+                 batch_size=PRUNE_BATCH, pause=PRUNE_PAUSE_SECONDS,
+                 vacuum_pages=VACUUM_PAGES, interval=RETENTION_INTERVAL_SECONDS, archive_path=None,
+                 convert=False):
+        super().__init__(interval, batch_size, pause)
+        self.retention_days = dict(RETENTION_DAYS if retention_days is None else retention_days)
+        self.default_days = default_days
+        self.vacuum_pages = vacuum_pages
+        self.archive_path = archive_path
+        self.convert_file = convert
+
+        # Counters
+        self.runs = 0
+        self.deleted = 0
+        self.vacuumed_pages = 0
+        self.converted = False
+        self.last_run = None
+
+    def _rules(self, now):
+        """
+        (SQL condition, params) per retention rule, each matching the
+        expired rows it covers.
+        """
+        rules = []
+        for level, days in self.retention_days.items():
+            rules.append(("level = ? AND time < ?", (level, now - days * 86400)))
+        levels = list(self.retention_days)
+        if levels:
+            rules.append(("level NOT IN (%s) AND time < ?" % ",".join("?" * len(levels)),
+                          (*levels, now - self.default_days * 86400)))
+        else:
+            rules.append(("time < ?", (now - self.default_days * 86400,)))
+        return rules
+
+    def _archive(self, rows):
+        with open(self.archive_path, "a", encoding="utf-8") as f:
+            for event_id, when, level, event in rows:
+                f.write(json.dumps({"id": event_id, "time": when, "level": level, "event": event}) + "\n")
+
+    def prune(self, conn, now=None):
+        """
+        Delete expired events batch by batch. Returns the number deleted.
+        """
+        if now is None:
+            now = time.time()
+        deleted = 0
+        for condition, params in self._rules(now):
+            if self.archive_path is None:
+                deleted += self.delete_batches(conn, "events", "id", condition, params)
+                continue
+
+            def step(limit, condition=condition, params=params):
+                rows = conn.execute(
+                    "SELECT id, time, level, event FROM events WHERE " + condition
+                    + " ORDER BY time LIMIT ?", (*params, limit)).fetchall()
+                if rows:
+                    self._archive(rows)
+                    conn.executemany("DELETE FROM events WHERE id = ?", [(row[0],) for row in rows])
+                return len(rows)
+
+            deleted += self.batches(conn, step)
+        return deleted
+
+    def convert(self, conn):
+        """
+        Switch the file to incremental auto-vacuum with a one-off full
+        VACUUM. Returns True once the file is incremental; if another
+        connection is busy it is left for the next pass.
+        """
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return True
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        try:
+            conn.execute("VACUUM")
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            print(" Log.db not converted to incremental vacuum yet:", e)
+            return False
+        return True
+
+    def vacuum(self, conn):
+        """
+        Release free pages in small steps. Returns how many were released;
+        always 0 on a file that is not incremental.
+        """
+        released = 0
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return released
+        while not self._stop.is_set():
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free == 0:
+                break
+            step = min(free, self.vacuum_pages)
+            # executescript steps the pragma to completion; execute() would free one page
+            conn.executescript(f"PRAGMA incremental_vacuum({step});")
+            released += step
+            time.sleep(self.pause)
+        return released
+
+    def run_once(self, now=None):
+        conn = database.open_connection(os.path.abspath(database.DB_FILE))
+        try:
+            deleted = self.prune(conn, now)
+            if self.convert_file:
+                self.converted = self.converted or self.convert(conn)
+            released = self.vacuum(conn)
+        finally:
+            conn.close()
+        self.runs += 1
+        self.deleted += deleted
+        self.vacuumed_pages += released
+        self.last_run = time.time()
+        return {"deleted": deleted, "vacuumed_pages": released}
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "deleted": self.deleted,
+            "vacuumed_pages": self.vacuumed_pages,
+            "converted": self.converted,
+            "last_run": self.last_run,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Delete expired events from Log.db.")
+    parser.add_argument("--archive", metavar="PATH", help="append deleted events here as JSON lines")
+    parser.add_argument("--convert", action="store_true",
+                        help="switch an older Log.db to incremental vacuum with one full VACUUM")
+    args = parser.parse_args(argv)
+
+    job = RetentionJob(archive_path=args.archive, convert=args.convert)
+    print(json.dumps(job.run_once()))
+
+
+if __name__ == "__main__":
+    main()
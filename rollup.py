@@ -0,0 +1,240 @@
+"""
+Per-minute and per-hour rollups of the sightings table in Log.db.
+
+Each pass reads only the sightings that arrived since the previous one
+(up to ROLLUP_DELAY_SECONDS ago, so the sighting writer's last batch is
+in), folds them into the minute rows of sighting_rollups and rebuilds the
+hour rows those minutes fall in. How far it got is kept in
+sighting_rollup_state, so history queries (DB.sighting_history,
+DB.item_rooms) never have to touch the raw sightings.
+
+Dwell is the time between two consecutive sightings of an item in the
+same room, as long as they are at most DWELL_MAX_GAP_SECONDS apart; a
+longer gap, or a sighting in another room in between, means the item was
+somewhere else. It is credited to the bucket of the later sighting.
+
+Raw sightings are kept for SIGHTING_RETENTION_DAYS, minute rows for
+MINUTE_ROLLUP_DAYS and hour rows for HOUR_ROLLUP_DAYS.
+
+The tracker runs this in the background; it can also be run by hand:
+
+    python rollup.py
+"""
+import argparse
+import json
+import os
+import time
+
+import database
+from jobs import BackgroundJob, PRUNE_BATCH, PRUNE_PAUSE_SECONDS
+
+# ---------------- CONFIG ----------------
+ROLLUP_INTERVAL_SECONDS = 60
+ROLLUP_DELAY_SECONDS = 10       # Leave sightings this recent for the next pass
+ROLLUP_CHUNK_SECONDS = 60 * 60  # Sightings rolled up per transaction when catching up
+DWELL_MAX_GAP_SECONDS = 90      # Stored sightings repeat every 30 s or so while an item stays put
+SIGHTING_RETENTION_DAYS = 7
+MINUTE_ROLLUP_DAYS = 30
+HOUR_ROLLUP_DAYS = 365
+# ----------------------------------------
+
+MINUTE = database.ROLLUP_MINUTE
+HOUR = database.ROLLUP_HOUR
+
+UPSERT_MINUTE = """
+    INSERT INTO sighting_rollups (resolution, item_id, bucket, room_id, count, rssi_min, rssi_max,
+                                  rssi_sum, rssi_count, dwell, first_seen, last_seen)
+    VALUES (%d, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (resolution, item_id, bucket, room_id) DO UPDATE SET
+        count = count + excluded.count,
+        rssi_min = MIN(COALESCE(rssi_min, excluded.rssi_min), COALESCE(excluded.rssi_min, rssi_min)),
+        rssi_max = MAX(COALESCE(rssi_max, excluded.rssi_max), COALESCE(excluded.rssi_max, rssi_max)),
+        rssi_sum = rssi_sum + excluded.rssi_sum,
+        rssi_count = rssi_count + excluded.rssi_count,
+        dwell = dwell + excluded.dwell,
+        first_seen = MIN(first_seen, excluded.first_seen),
+        last_seen = MAX(last_seen, excluded.last_seen)
+""" % MINUTE
+
+# Hour rows are always rebuilt from the minute rows, never added to
+REBUILD_HOURS = """
+    INSERT INTO sighting_rollups
+    SELECT %d, item_id, bucket - bucket %% %d, room_id, SUM(count), MIN(rssi_min), MAX(rssi_max),
+           SUM(rssi_sum), SUM(rssi_count), SUM(dwell), MIN(first_seen), MAX(last_seen)
+    FROM sighting_rollups
+    WHERE resolution = %d AND item_id = ? AND bucket >= ? AND bucket < ?
+    GROUP BY 3, room_id
+""" % (HOUR, HOUR, MINUTE)
+
+
+class SightingRollup(BackgroundJob):
+    """
+    Keeps sighting_rollups up to date, once per `interval` seconds after
+    start(), or on demand with run_once().
+
+    Sightings written with a time before the current watermark (e.g. a
+    replayed capture) are stored but never rolled up.
+    """
+
+    name = "sighting-rollup"
+    label = "Sighting rollup"
+
+    def __init__(self, interval=ROLLUP_INTERVAL_SECONDS, delay=ROLLUP_DELAY_SECONDS,
+                 chunk=ROLLUP_CHUNK_SECONDS, max_gap=DWELL_MAX_GAP_SECONDS,
+                 sighting_days=SIGHTING_RETENTION_DAYS, minute_days=MINUTE_ROLLUP_DAYS,
+                 hour_days=HOUR_ROLLUP_DAYS, batch_size=PRUNE_BATCH, pause=PRUNE_PAUSE_SECONDS):
+        super().__init__(interval, batch_size, pause)
+        self.delay = delay
+        self.chunk = chunk
+        self.max_gap = max_gap
+        self.sighting_days = sighting_days
+        self.minute_days = minute_days
+        self.hour_days = hour_days
+
+        # Counters
+        self.runs = 0
+        self.sightings = 0
+        self.minute_rows = 0
+        self.pruned = 0
+        self.done_until = None
+        self.last_run = None
+
+    def _item_ids(self, conn):
+        """
+        Every item id in sightings, one primary key seek each.
+        """
+        item_id = -1
+        while True:
+            item_id = conn.execute(
+                "SELECT MIN(item_id) FROM sightings WHERE item_id > ?", (item_id,)).fetchone()[0]
+            if item_id is None:
+                return
+            yield item_id
+
+    def watermark(self, conn):
+        """
+        Time up to which sightings are rolled up, or None before the first pass.
+        """
+        row = conn.execute("SELECT done_until FROM sighting_rollup_state WHERE id = 1").fetchone()
+        if row is not None:
+            return row[0]
+        first = [conn.execute("SELECT MIN(time) FROM sightings WHERE item_id = ?", (item_id,)).fetchone()[0]
+                 for item_id in list(self._item_ids(conn))]
+        return min(first) if first else None
+
+    def roll_up(self, conn, start, end):
+        """
+        Fold sightings with start <= time < end into the rollups. Returns
+        (sightings read, minute rows written). Runs inside the caller's
+        transaction.
+        """
+        read = 0
+        written = 0
+        for item_id in list(self._item_ids(conn)):
+            minutes = {}      # (bucket, room id) -> [count, min, max, sum, rssi count, dwell, first, last]
+            previous = None   # (room id, time) of the item's previous sighting
+            # Starting max_gap early only to find the dwell of the first sightings
+            rows = conn.execute(
+                "SELECT room_id, time, rssi FROM sightings WHERE item_id = ? AND time >= ? AND time < ?"
+                " ORDER BY time", (item_id, start - self.max_gap, end))
+            for room_id, when, rssi in rows:
+                last = previous[1] if previous is not None and previous[0] == room_id else None
+                previous = (room_id, when)
+                if when < start:
+                    continue
+
+                key = (int(when // MINUTE) * MINUTE, room_id)
+                row = minutes.get(key)
+                if row is None:
+                    row = minutes[key] = [0, None, None, 0, 0, 0.0, when, when]
+                row[0] += 1
+                if rssi is not None:
+                    row[1] = rssi if row[1] is None else min(row[1], rssi)
+                    row[2] = rssi if row[2] is None else max(row[2], rssi)
+                    row[3] += rssi
+                    row[4] += 1
+                if last is not None and when - last <= self.max_gap:
+                    row[5] += when - last
+                row[7] = when
+                read += 1
+
+            if not minutes:
+                continue
+            conn.executemany(UPSERT_MINUTE, [(item_id, bucket, room_id, *row)
+                                             for (bucket, room_id), row in minutes.items()])
+            first_hour = min(bucket for bucket, _ in minutes) // HOUR * HOUR
+            end_hour = max(bucket for bucket, _ in minutes) // HOUR * HOUR + HOUR
+            conn.execute("DELETE FROM sighting_rollups WHERE resolution = ? AND item_id = ?"
+                         " AND bucket >= ? AND bucket < ?", (HOUR, item_id, first_hour, end_hour))
+            conn.execute(REBUILD_HOURS, (item_id, first_hour, end_hour))
+            written += len(minutes)
+        return read, written
+
+    def prune(self, conn, now, done_until):
+        """
+        Delete expired sightings (only once rolled up) and rollup rows.
+        Returns the number of rows deleted.
+        """
+        sightings_before = min(now - self.sighting_days * 86400, done_until)
+        deleted = 0
+        for item_id in list(self._item_ids(conn)):
+            deleted += self.delete_batches(conn, "sightings", "item_id, time, room_id",
+                                           "item_id = ? AND time < ?", (item_id, sightings_before))
+            for resolution, days in ((MINUTE, self.minute_days), (HOUR, self.hour_days)):
+                deleted += self.delete_batches(conn, "sighting_rollups", "resolution, item_id, bucket, room_id",
+                                               "resolution = ? AND item_id = ? AND bucket < ?",
+                                               (resolution, item_id, now - days * 86400))
+        return deleted
+
+    def run_once(self, now=None):
+        if now is None:
+            now = time.time()
+        until = now - self.delay
+        read = written = deleted = 0
+
+        conn = database.open_connection(os.path.abspath(database.DB_FILE))
+        try:
+            done = self.watermark(conn)
+            while done is not None and done < until and not self._stop.is_set():
+                end = min(until, done + self.chunk)
+                with conn:
+                    chunk_read, chunk_written = self.roll_up(conn, done, end)
+                    conn.execute("INSERT OR REPLACE INTO sighting_rollup_state (id, done_until) VALUES (1, ?)",
+                                 (end,))
+                read += chunk_read
+                written += chunk_written
+                done = end
+            if done is not None:
+                deleted = self.prune(conn, now, done)
+        finally:
+            conn.close()
+
+        self.runs += 1
+        self.sightings += read
+        self.minute_rows += written
+        self.pruned += deleted
+        self.done_until = done
+        self.last_run = time.time()
+        return {"sightings": read, "minute_rows": written, "pruned": deleted, "done_until": done}
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "sightings": self.sightings,
+            "minute_rows": self.minute_rows,
+            "pruned": self.pruned,
+            "done_until": self.done_until,
+            "last_run": self.last_run,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Roll up new sightings in Log.db.")
+    parser.parse_args(argv)
+
+    database.flush_sightings()
+    print(json.dumps(SightingRollup().run_once()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+Sharded tracker for deployments that serve several homes.
+
+One router process subscribes to the broker and hands each message to the
+worker process that owns its home. Every worker is a normal tracker
+(tracker.py state, apply_batch, exit checks) running in its own process
+and its own directory, so homes are spread over cores instead of sharing
+one GIL.
+
+Topics:
+
+    ble/<home>/<room>   sightings, same payloads as ble/<room>
+    ble/<room>          sightings for DEFAULT_HOME (single-home scanners)
+    pir/<home>          a PIR edge at that home's front door, published by
+                        pir_publisher.py on the Pi wired to the sensor
+
+Each home lives in HOMES_DIR/<home>/ with its own Log.db, last_seen.json
+and log_journal/; DEFAULT_HOME stays in DEFAULT_HOME_DIR, so it keeps the
+items, events and last seen rooms of a single-home install. Only the
+configured homes are served, and their workers are started up front;
+messages for any other home are counted as unroutable. Workers report
+their status to the router, which merges it into STATUS_FILE (read by the
+relay at /homes and by the GUI's Homes screen).
+
+    python sharded.py [--homes home1 home2 ...]
+    python sharded.py --add-item home2 "Keys" AA:BB:CC:DD:EE:FF
+    python sharded.py --list-items home2
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+import database
+from database import format_mac
+from state import atomic_write_json
+
+# ---------------- CONFIG ----------------
+MQTT_BROKER = "localhost"
+SIGHTING_TOPIC = "ble/#"
+PIR_TOPIC = "pir/+"
+DEFAULT_HOME = "home"          # Home for two-level ble/<room> topics
+DEFAULT_HOME_DIR = "."         # Working directory of DEFAULT_HOME, the single-home files
+HOMES = [DEFAULT_HOME]         # Homes served when --homes is not given
+HOMES_DIR = "homes"            # One working directory per other home
+STATUS_FILE = "status.json"    # Merged status of every home
+STATUS_SECONDS = 2             # How often workers report and the router writes STATUS_FILE
+ROUTER_BATCH = 200             # Messages per hand-off to a worker...
+ROUTER_FLUSH_SECONDS = 0.05    # ...or whatever is pending after this long
+WORKER_QUEUE_SIZE = 256        # Batches waiting per worker before the router drops new ones
+WORKER_RESTART_SECONDS = 5     # Least time between restarts of a home's worker
+# ----------------------------------------
+
+# Messages on a worker's inbox
+SIGHTINGS = 0
+PIR = 1
+
+
+# ---------------- WORKER ----------------
+def home_dir(home):
+    return DEFAULT_HOME_DIR if home == DEFAULT_HOME else os.path.join(HOMES_DIR, home)
+
+
+def open_home(home):
+    """
+    Make `home`'s directory the working directory, creating it if needed,
+    so Log.db and the tracker's other files are that home's.
+    """
+    os.makedirs(home_dir(home), exist_ok=True)
+    os.chdir(home_dir(home))
+
+
+def home_status(tracker, home, last_exit):
+    """
+    Status of one home: where every registered item was last seen and
+    which ones are missing right now.
+    """
+    now = time.time()
+    items = {}
+    for mac, name in tracker.allowlist.names.items():
+        seen = tracker.last_seen.get(mac)
+        items[name] = {
+            "mac": format_mac(mac),
+            "room": tracker.rooms.name(seen.room) if seen is not None else None,
+            "last_seen": seen.time if seen is not None else None,
+        }
+    return {
+        "home": home,
+        "updated": now,
+        "pid": os.getpid(),
+        "items": items,
+        "missing": tracker.missing_index.missing(now),
+        "last_exit": last_exit,
+        "duplicates": dict(tracker.duplicate_stats),
+    }
+
+
+def worker_main(home, inbox, outbox):
+    """
+    Runs one home's tracker in this process until it receives None.
+    """
+    open_home(home)
+
+    # Imported after the chdir so the tracker's files belong to this home
+    import tracker
+    from rollup import SightingRollup
+
+    tracker.recover_last_seen()
+    tracker.reload_registered_items(force=True)
+    tracker.seed_missing_index()
+    tracker.last_seen.start()
+    sighting_rollup = SightingRollup()
+    sighting_rollup.start()
+
+    last_exit = None
+    next_status = 0.0
+    try:
+        while True:
+            try:
+                message = inbox.get(timeout=STATUS_SECONDS)
+            except queue.Empty:
+                message = ()
+
+            if message is None:
+                break
+            if message:
+                kind, value = message
+                try:
+                    tracker.reload_registered_items()
+                    if kind == SIGHTINGS:
+                        tracker.process_batch(value)
+                    else:
+                        missing = tracker.check_missing_items(now=value)
+                        last_exit = {"time": value, "missing": missing}
+                except Exception as e:
+                    print(f" [{home}] Failed to process message:", e)
+
+            if time.monotonic() >= next_status:
+                next_status = time.monotonic() + STATUS_SECONDS
+                outbox.put(home_status(tracker, home, last_exit))
+    finally:
+        tracker.last_seen.stop()
+        sighting_rollup.stop()
+        tracker.journal.close()
+        outbox.put(home_status(tracker, home, last_exit))
+
+
+# ---------------- ROUTER ----------------
+class Router:
+    """
+    Partitions incoming messages by home and batches them to the workers.
+
+    The router never parses payloads; it only reads the topic, so the JSON
+    work happens in the workers. Only `homes` are routed, and their workers
+    are started by start(), never from paho's callback. Hand-offs never
+    block paho's network thread: a batch for a worker whose inbox is full
+    is dropped and counted. The flusher also restarts workers that died.
+    """
+
+    def __init__(self, context, homes):
+        self.context = context
+        self.homes = frozenset(homes)
+        self.lock = threading.Lock()
+        self.workers = {}   # home -> (process, inbox)
+        self.started = {}   # home -> monotonic time its worker was last started
+        self.pending = {}   # home -> [(payload, received)]
+        self.outbox = context.Queue()
+        self.status = {}    # home -> latest status from its worker
+        self.stopping = threading.Event()
+
+        # Counters
+        self.routed = 0
+        self.unroutable = 0
+        self.dropped = 0        # Messages lost to a full inbox
+        self.dropped_pir = 0
+        self.restarts = 0
+
+    def start_worker(self, home):
+        # Called with the lock held
+        inbox = self.context.Queue(WORKER_QUEUE_SIZE)
+        process = self.context.Process(
+            target=worker_main, args=(home, inbox, self.outbox), name=f"tracker-{home}", daemon=True)
+        process.start()
+        self.workers[home] = (process, inbox)
+        self.started[home] = time.monotonic()
+        print(f" Started worker for {home} (pid {process.pid})")
+        return inbox
+
+    def start(self):
+        with self.lock:
+            for home in sorted(self.homes):
+                if home not in self.workers:
+                    self.start_worker(home)
+
+    def route(self, topic):
+        """
+        (kind, home) for a topic, or None if it is not for a served home.
+        """
+        parts = topic.split("/")
+        if parts[0] == "pir" and len(parts) == 2:
+            kind, home = PIR, parts[1]
+        elif parts[0] == "ble" and len(parts) in (2, 3):
+            kind, home = SIGHTINGS, parts[1] if len(parts) == 3 else DEFAULT_HOME
+        else:
+            return None
+        return (kind, home) if home in self.homes else None
+
+    def on_message(self, client, userdata, msg):
+        received = time.time()
+        route = self.route(msg.topic)
+
+        with self.lock:
+            if route is None:
+                self.unroutable += 1
+                return
+            kind, home = route
+            if kind == PIR:
+                # Everything already received for the home counts for the edge
+                self._flush(home)
+                if not self._send(home, (PIR, received)):
+                    self.dropped_pir += 1
+            else:
+                pending = self.pending.setdefault(home, [])
+                pending.append((msg.payload, received))
+                if len(pending) >= ROUTER_BATCH:
+                    self._flush(home)
+            self.routed += 1
+
+    def _flush(self, home):
+        # Called with the lock held
+        pending = self.pending.pop(home, None)
+        if pending and not self._send(home, (SIGHTINGS, pending)):
+            self.dropped += len(pending)
+
+    def _send(self, home, message):
+        # Called with the lock held; start() made a worker for every routed home
+        try:
+            self.workers[home][1].put_nowait(message)
+        except queue.Full:
+            return False
+        return True
+
+    def check_workers(self):
+        """
+        Restart workers that exited, at most once per WORKER_RESTART_SECONDS each.
+        """
+        with self.lock:
+            for home, (process, inbox) in list(self.workers.items()):
+                if process.is_alive() or self.stopping.is_set():
+                    continue
+                if time.monotonic() - self.started[home] < WORKER_RESTART_SECONDS:
+                    continue
+                print(f" Worker for {home} exited with code {process.exitcode}, restarting")
+                # Whatever was still queued for the dead worker is lost with its inbox
+                inbox.cancel_join_thread()
+                self.start_worker(home)
+                self.restarts += 1
+
+    def flush_all(self):
+        with self.lock:
+            for home in list(self.pending):
+                self._flush(home)
+
+    def flusher(self):
+        while not self.stopping.wait(ROUTER_FLUSH_SECONDS):
+            self.flush_all()
+            self.check_workers()
+
+    def collect_status(self):
+        next_write = time.monotonic() + STATUS_SECONDS
+        while True:
+            try:
+                status = self.outbox.get(timeout=STATUS_SECONDS)
+                self.status[status["home"]] = status
+            except queue.Empty:
+                pass
+            if self.stopping.is_set() and not any(p.is_alive() for p, _ in list(self.workers.values())):
+                break
+            if time.monotonic() >= next_write:
+                next_write = time.monotonic() + STATUS_SECONDS
+                self.write_status()
+
+        # Pick up the final reports
+        while True:
+            try:
+                status = self.outbox.get_nowait()
+            except queue.Empty:
+                break
+            self.status[status["home"]] = status
+        self.write_status()
+
+    def write_status(self):
+        try:
+            atomic_write_json(STATUS_FILE, {
+                "updated": time.time(),
+                "router": self.stats(),
+                "homes": self.status,
+            })
+        except OSError as e:
+            print(" Could not write status:", e)
+
+    def stop(self):
+        self.flush_all()
+        self.stopping.set()
+        with self.lock:
+            workers = list(self.workers.values())
+        for process, inbox in workers:
+            if process.is_alive():
+                inbox.put(None)
+        for process, _ in workers:
+            process.join()
+
+    def stats(self):
+        return {
+            "homes": sorted(self.homes),
+            "workers": len(self.workers),
+            "routed": self.routed,
+            "unroutable": self.unroutable,
+            "dropped": self.dropped,
+            "dropped_pir": self.dropped_pir,
+            "restarts": self.restarts,
+        }
+
+
+# ---------------- ITEMS ----------------
+def add_item(home, name, mac, desc=""):
+    """
+    Register an item in `home`'s Log.db. A running worker picks it up on
+    its next items check.
+    """
+    open_home(home)
+    return database.DB().add_item(name, desc, database.normalize_mac(mac))
+
+
+def list_items(home):
+    open_home(home)
+    return database.DB().get_items()
+
+
+# ---------------- MAIN ----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded front door tracker for several homes.")
+    parser.add_argument("--homes", nargs="+", default=HOMES, help="homes to serve; other homes are not routed")
+    parser.add_argument("--add-item", nargs=3, metavar=("HOME", "NAME", "MAC"),
+                        help="register an item for a home and exit")
+    parser.add_argument("--description", default="", help="description for --add-item")
+    parser.add_argument("--list-items", metavar="HOME", help="print a home's registered items and exit")
+    args = parser.parse_args(argv)
+
+    if args.add_item:
+        home, name, mac = args.add_item
+        if database.normalize_mac(mac) is None:
+            parser.error(f"not a MAC address: {mac}")
+        item_id = add_item(home, name, mac, args.description)
+        print(f" Registered {name} for {home} (id {item_id})")
+        return
+    if args.list_items:
+        for item_id, name, desc, mac in list_items(args.list_items):
+            print(f" {item_id}\t{name}\t{mac}\t{desc or ''}")
+        return
+
+    # Workers import tracker themselves, in their own directory
+    router = Router(multiprocessing.get_context("spawn"), args.homes)
+    router.start()
+
+    flusher = threading.Thread(target=router.flusher, name="router-flush", daemon=True)
+    collector = threading.Thread(target=router.collect_status, name="router-status")
+    flusher.start()
+    collector.start()
+
+    client = mqtt.Client()
+    client.on_message = router.on_message
+    client.connect(MQTT_BROKER, 1883, 60)
+    client.subscribe([(SIGHTING_TOPIC, 0), (PIR_TOPIC, 0)])
+
+    print(" Sharded Tracker Running...")
+    try:
+        client.loop_forever()
+    finally:
+        router.stop()
+        collector.join()
+        print(" Router stats:", router.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import threading
+
+
+class ExitSpeculator:
+    """
+    Works out the exit check ahead of the PIR edge.
+
+    The front door scanner usually hears the items someone is carrying
+    before they cross the PIR, so the tracker calls speculate() on those
+    sightings. It takes the missing items from `index` (a MissingItemIndex)
+    and turns them into a report with `describe`, e.g. adding the room each
+    item was last seen in.
+
+    confirm() at the PIR edge returns the cached report as long as the
+    index version has not moved since, i.e. no item came or went in the
+    meantime. Otherwise it recomputes, and the counters record whether the
+    speculation would still have been right.
+    """
+
+    def __init__(self, index, describe):
+        self.index = index
+        self.describe = describe
+        self.lock = threading.Lock()
+        self.cached = None   # (index version, missing entries, report)
+
+        # Counters
+        self.speculations = 0
+        self.hits = 0        # Cached report used as is
+        self.matched = 0     # Recomputed, but came out the same as the speculation
+        self.mismatched = 0  # Recomputed and different
+        self.cold = 0        # PIR edge with nothing speculated
+
+    def speculate(self, now):
+        with self.lock:
+            cached = self.cached
+        if cached is not None and cached[0] == self.index.version_at(now):
+            return
+
+        version, entries = self.index.snapshot(now)
+        report = self.describe(entries)
+        with self.lock:
+            self.cached = (version, entries, report)
+            self.speculations += 1
+
+    def confirm(self, now):
+        """
+        Return (missing entries, report) for an exit at `now`.
+        """
+        with self.lock:
+            cached = self.cached
+            self.cached = None
+
+        if cached is not None and cached[0] == self.index.version_at(now):
+            with self.lock:
+                self.hits += 1
+            return cached[1], cached[2]
+
+        entries = self.index.snapshot(now)[1]
+        with self.lock:
+            if cached is None:
+                self.cold += 1
+            elif set(cached[1]) == set(entries):
+                self.matched += 1
+            else:
+                self.mismatched += 1
+        return entries, self.describe(entries)
+
+    def stats(self):
+        with self.lock:
+            checked = self.hits + self.matched + self.mismatched
+            return {
+                "speculations": self.speculations,
+                "hits": self.hits,
+                "matched": self.matched,
+                "mismatched": self.mismatched,
+                "cold": self.cold,
+                "hit_rate": (self.hits + self.matched) / checked if checked else None,
+            }
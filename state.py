@@ -0,0 +1,626 @@
+import heapq
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from database import mac_to_int, format_mac
+
+
+# ---------------- HELPERS ----------------
+def atomic_write_json(path, data):
+    """
+    Write JSON to a temp file next to `path` and rename it over the original,
+    so readers never see a half written file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        # mkstemp creates the file 0600, keep it readable like a normal save
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def parse_timestamp(value):
+    # Snapshots store ISO strings, the WAL stores epoch seconds
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    return float(value)
+
+
+def load_snapshot(path):
+    """
+    Return (generation, entries) from a last seen snapshot, where entries
+    maps mac string -> {"room", "timestamp", "rssi"} as written on disk.
+    """
+    with open(path, "r") as f:
+        data = json.load(f)
+
+    if "entries" in data and "generation" in data:
+        generation, data = data["generation"], data["entries"]
+    else:
+        # Written before the WAL existed
+        generation = 0
+
+    # Older files only stored mac -> room, skip anything without a timestamp
+    return generation, {
+        mac: info for mac, info in data.items()
+        if isinstance(info, dict) and "timestamp" in info
+    }
+
+
+def read_wal(path):
+    """
+    Yield (mac, room, timestamp, rssi) records, stopping at a torn last line.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                return
+            try:
+                mac, room, timestamp, rssi = json.loads(line)
+            except ValueError:
+                return
+            yield mac, room, timestamp, rssi
+
+
+# ---------------- COMPACT RECORDS ----------------
+class RoomTable:
+    """
+    Interns room names to small integer ids. Ids are only meaningful
+    inside one process; names are what goes to disk.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = {}
+        self.names = []
+
+    def intern(self, name):
+        room_id = self.ids.get(name)
+        if room_id is None:
+            with self.lock:
+                room_id = self.ids.get(name)
+                if room_id is None:
+                    room_id = self.ids[name] = len(self.names)
+                    self.names.append(name)
+        return room_id
+
+    def name(self, room_id):
+        return self.names[room_id]
+
+    def __len__(self):
+        return len(self.names)
+
+
+class Sighting:
+    """
+    Last sighting of one item: interned room id, epoch seconds and RSSI.
+    """
+
+    __slots__ = ("room", "time", "rssi")
+
+    def __init__(self, room, time, rssi):
+        self.room = room
+        self.time = time
+        self.rssi = rssi
+
+
+# ---------------- LAST SEEN STORE ----------------
+class LastSeenStore:
+    """
+    Resident copy of last_seen.json, made crash safe with a write-ahead log.
+
+    In memory the table maps 48-bit integer MACs to Sighting records;
+    MAC strings, room names and ISO timestamps only appear on disk.
+
+    Every persisted change is appended to `<path>.wal.<generation>` before
+    it is visible in memory, and the WAL is fsynced at most every
+    `wal_fsync_interval` seconds. With `write_behind` the records are only
+    queued, and sync_wal() writes them out, so a caller on an event loop
+    never touches the disk. flush() starts a new WAL generation, writes a
+    compact snapshot tagged with it and then deletes the older WAL files,
+    so recover() only ever has to load one snapshot plus the WAL written
+    since. Once start() is called, a thread runs sync_wal() every
+    `wal_fsync_interval` seconds and flush() every `interval` seconds,
+    early once the WAL holds `wal_max_records`, and from stop().
+
+    MACs passed to set_pinned() (the registered items) are kept forever.
+    Any other MAC is dropped once it has not been seen for `ttl` seconds,
+    checked before each periodic flush, or as soon as the table grows past
+    `capacity`, least recently seen first.
+    """
+
+    def __init__(self, path, rooms, interval=10, wal_fsync_interval=1.0, wal_max_records=50000,
+                 capacity=None, ttl=None, write_behind=False):
+        self.path = path
+        self.rooms = rooms
+        self.interval = interval
+        self.wal_fsync_interval = wal_fsync_interval
+        self.wal_max_records = wal_max_records
+        self.lock = threading.Lock()
+        self.entries = {}   # mac int -> Sighting
+        self.dirty = False
+        self.recovery = None
+
+        self.capacity = capacity
+        self.ttl = ttl
+        self.pinned = frozenset()
+        self.unpinned = OrderedDict()   # unpinned mac -> None, least recently seen first
+        self.evicted_ttl = 0
+        self.evicted_lru = 0
+
+        self.generation = 0
+        self.wal = None
+        self.wal_records = 0
+        self.last_sync = 0.0
+        self.unsynced = False
+        self.write_behind = write_behind
+        self.wal_pending = []               # write_behind records not in the WAL yet
+        self.wal_lock = threading.Lock()    # the WAL file; taken after self.lock, never before
+        self.sync_lock = threading.Lock()   # one sync_wal() at a time, so records stay in order
+
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    # ---------------- RECOVERY ----------------
+    def wal_path(self, generation):
+        return f"{self.path}.wal.{generation}"
+
+    def wal_files(self):
+        """
+        (generation, path) of every WAL file on disk, oldest first.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        prefix = os.path.basename(self.path) + ".wal."
+        files = []
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name[len(prefix):].isdigit():
+                files.append((int(name[len(prefix):]), os.path.join(directory, name)))
+        files.sort()
+        return files
+
+    def _restore(self, entries, mac, room, timestamp, rssi):
+        if isinstance(mac, str):
+            mac = mac_to_int(mac)
+        if mac is None or not isinstance(room, str):
+            return False
+        try:
+            when = parse_timestamp(timestamp)
+        except (TypeError, ValueError):
+            return False
+        entries[mac] = Sighting(self.rooms.intern(room), when, rssi)
+        return True
+
+    def recover(self):
+        """
+        Rebuild the table from the snapshot and the WAL, then start a fresh
+        generation. Returns timing and size stats, also kept in self.recovery.
+        """
+        started = time.monotonic()
+
+        snapshot_error = None
+        try:
+            generation, saved = load_snapshot(self.path)
+        except FileNotFoundError:
+            generation, saved = 0, {}
+        except (OSError, ValueError) as e:
+            # The snapshot is always renamed into place, so this means
+            # outside damage; the WAL may still cover some of it
+            snapshot_error = str(e)
+            generation, saved = 0, {}
+
+        entries = {}
+        for mac, info in saved.items():
+            self._restore(entries, mac, info.get("room"), info["timestamp"], info.get("rssi"))
+        snapshot_entries = len(entries)
+
+        replayed = 0
+        latest = generation
+        for wal_generation, path in self.wal_files():
+            latest = max(latest, wal_generation)
+            if wal_generation < generation:
+                continue
+            for mac, room, timestamp, rssi in read_wal(path):
+                if self._restore(entries, mac, room, timestamp, rssi):
+                    replayed += 1
+
+        with self.lock:
+            self.entries = entries
+            self._track_unpinned()
+            self.generation = latest
+            self.dirty = True
+        # Fold the WAL into a new snapshot so the next restart starts clean
+        self.flush()
+
+        self.recovery = {
+            "snapshot_entries": snapshot_entries,
+            "wal_records": replayed,
+            "entries": len(entries),
+            "seconds": time.monotonic() - started,
+        }
+        if snapshot_error is not None:
+            self.recovery["snapshot_error"] = snapshot_error
+        return self.recovery
+
+    # ---------------- UPDATES ----------------
+    def _log(self, records):
+        # Called with the lock held; records are (mac, room id, time, rssi)
+        self.wal_records += len(records)
+        if self.wal_records >= self.wal_max_records:
+            self._wake.set()
+        if self.write_behind:
+            self.wal_pending.extend(records)
+            return
+
+        with self.wal_lock:
+            self._write_wal(records)
+            if time.monotonic() - self.last_sync >= self.wal_fsync_interval:
+                self._sync()
+
+    def _write_wal(self, records):
+        # Called with wal_lock held
+        if self.wal is None:
+            self.wal = open(self.wal_path(self.generation), "a", encoding="utf-8")
+            self.last_sync = time.monotonic()
+        names = self.rooms.names
+        self.wal.write("".join(
+            json.dumps((mac, names[room], when, rssi), separators=(",", ":")) + "\n"
+            for mac, room, when, rssi in records))
+        self.wal.flush()
+        self.unsynced = True
+
+    def _sync(self):
+        # Called with wal_lock held
+        if self.wal is not None and self.unsynced:
+            os.fsync(self.wal.fileno())
+        self.unsynced = False
+        self.last_sync = time.monotonic()
+
+    def sync_wal(self):
+        """
+        Write out queued write_behind records and fsync the WAL.
+        """
+        with self.sync_lock:
+            with self.lock:
+                records = self.wal_pending
+                self.wal_pending = []
+                generation = self.generation
+            with self.wal_lock:
+                # If flush() ran in between, its snapshot already has these
+                if records and generation == self.generation:
+                    self._write_wal(records)
+                self._sync()
+
+    def update(self, mac, room, when, rssi):
+        with self.lock:
+            self._log(((mac, room, when, rssi),))
+            self.entries[mac] = Sighting(room, when, rssi)
+            self.dirty = True
+            if mac not in self.pinned:
+                self._used(mac)
+                self._evict_lru()
+
+    def apply(self, changes):
+        """
+        Apply a batch of sightings under one lock. `changes` maps
+        mac -> (room id, time, rssi, persist); persist=False only
+        refreshes the time of an existing entry, without scheduling a write.
+        """
+        with self.lock:
+            entries = self.entries
+            pinned = self.pinned
+            records = []
+            for mac, (room, when, rssi, persist) in changes.items():
+                entry = entries.get(mac)
+                if not persist and entry is not None:
+                    entry.time = when
+                else:
+                    records.append((mac, room, when, rssi))
+                if mac not in pinned:
+                    self._used(mac)
+
+            if records:
+                self._log(records)
+                for mac, room, when, rssi in records:
+                    entries[mac] = Sighting(room, when, rssi)
+                self.dirty = True
+                self._evict_lru()
+
+    def get(self, mac):
+        return self.entries.get(mac)
+
+    # ---------------- EVICTION ----------------
+    def set_pinned(self, macs):
+        """
+        Keep `macs` regardless of age or capacity; everything else may be evicted.
+        """
+        with self.lock:
+            self.pinned = frozenset(macs)
+            self._track_unpinned()
+
+    def _track_unpinned(self):
+        # Called with the lock held
+        pinned = self.pinned
+        entries = self.entries
+        unpinned = sorted((mac for mac in entries if mac not in pinned), key=lambda mac: entries[mac].time)
+        self.unpinned = OrderedDict.fromkeys(unpinned)
+
+    def _used(self, mac):
+        # Called with the lock held, for unpinned MACs only
+        unpinned = self.unpinned
+        if mac in unpinned:
+            unpinned.move_to_end(mac)
+        else:
+            unpinned[mac] = None
+
+    def _evict_lru(self):
+        # Called with the lock held
+        if self.capacity is None:
+            return
+        entries = self.entries
+        unpinned = self.unpinned
+        while len(entries) > self.capacity and unpinned:
+            mac, _ = unpinned.popitem(last=False)
+            entries.pop(mac, None)
+            self.evicted_lru += 1
+            self.dirty = True
+
+    def evict(self, now):
+        """
+        Drop unpinned entries not seen for `ttl` seconds. Returns how many.
+        """
+        if self.ttl is None:
+            return 0
+        cutoff = now - self.ttl
+        evicted = 0
+        with self.lock:
+            entries = self.entries
+            unpinned = self.unpinned
+            while unpinned:
+                mac = next(iter(unpinned))
+                entry = entries.get(mac)
+                if entry is not None and entry.time >= cutoff:
+                    break
+                del unpinned[mac]
+                entries.pop(mac, None)
+                evicted += 1
+            if evicted:
+                self.evicted_ttl += evicted
+                self.dirty = True
+        return evicted
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "pinned": len(self.entries) - len(self.unpinned),
+                "unpinned": len(self.unpinned),
+                "capacity": self.capacity,
+                "evicted_ttl": self.evicted_ttl,
+                "evicted_lru": self.evicted_lru,
+            }
+
+    def __contains__(self, mac):
+        return mac in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    # ---------------- SNAPSHOTS ----------------
+    def to_json(self, entries=None):
+        """
+        The table in its on-disk form: {mac string: {"room", "timestamp", "rssi"}}.
+        """
+        if entries is None:
+            entries = dict(self.entries)
+        names = self.rooms.names
+        return {
+            format_mac(mac): {
+                "room": names[entry.room],
+                "timestamp": datetime.fromtimestamp(entry.time).isoformat(),
+                "rssi": entry.rssi,
+            }
+            for mac, entry in entries.items()
+        }
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return False
+            # Only the dict is copied; a record changed after this point
+            # just means the snapshot carries a newer time
+            entries = dict(self.entries)
+            self.dirty = False
+            self.wal_pending = []   # in `entries` already
+
+            # Later changes go to a new WAL generation
+            with self.wal_lock:
+                old_wal, old_unsynced = self.wal, self.unsynced
+                self.wal = None
+                self.unsynced = False
+                self.generation += 1
+            self.wal_records = 0
+            generation = self.generation
+
+        # Synced in case the snapshot below fails, but outside the lock
+        if old_wal is not None:
+            if old_unsynced:
+                os.fsync(old_wal.fileno())
+            old_wal.close()
+
+        try:
+            atomic_write_json(self.path, {"generation": generation, "entries": self.to_json(entries)})
+        except OSError:
+            with self.lock:
+                self.dirty = True
+            raise
+
+        # Everything before `generation` is in the snapshot now
+        for wal_generation, path in self.wal_files():
+            if wal_generation < generation:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        return True
+
+    def _run(self):
+        next_flush = time.monotonic() + self.interval
+        while not self._stop.is_set():
+            woken = self._wake.wait(min(self.interval, self.wal_fsync_interval))
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                # Without this the last records before a quiet spell would wait for the next append
+                self.sync_wal()
+                if woken or time.monotonic() >= next_flush:
+                    next_flush = time.monotonic() + self.interval
+                    self.evict(time.time())
+                    self.flush()
+            except OSError as e:
+                print(" Could not save last seen state:", e)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="last-seen-flush", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self.sync_wal()
+        with self.lock, self.wal_lock:
+            if self.wal is not None:
+                self.wal.close()
+                self.wal = None
+
+
+# ---------------- MISSING ITEM INDEX ----------------
+class MissingItemIndex:
+    """
+    Keeps registered items split into present / missing as sightings arrive.
+
+    Every sighting of a registered MAC pushes (expiry, mac) onto a heap.
+    Expired entries are popped lazily, so missing() only has to move the
+    items that timed out since the last call and then return the names.
+
+    `version` goes up whenever an item moves between present and missing,
+    so a result computed earlier is still right while it is unchanged.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.names = {}      # registered mac -> item name
+        self.expires = {}    # registered mac -> time its latest sighting expires
+        self.heap = []       # (expiry, mac), may hold stale entries
+        self.present = set()
+        self.missing_macs = set()
+        self.version = 0
+
+    def set_registered(self, names):
+        """
+        Replace the registered item set with `names` (mac -> item name).
+        An unchanged set keeps the current state and version.
+        """
+        with self.lock:
+            if names == self.names:
+                return
+            self.names = dict(names)
+            self.expires = {mac: t for mac, t in self.expires.items() if mac in self.names}
+            self.heap = [(t, mac) for mac, t in self.expires.items()]
+            heapq.heapify(self.heap)
+            self.present = set(self.expires)
+            self.missing_macs = set(self.names) - self.present
+            self.version += 1
+
+    def seen(self, mac, when):
+        with self.lock:
+            self._seen(mac, when)
+            # Keep the heap at roughly one timeout window of sightings
+            self._expire(when)
+
+    def seen_many(self, sightings):
+        """
+        Record a batch of (mac, time) sightings under one lock.
+        """
+        latest = float("-inf")
+        with self.lock:
+            for mac, when in sightings:
+                self._seen(mac, when)
+                if when > latest:
+                    latest = when
+            self._expire(latest)
+
+    def _seen(self, mac, when):
+        if mac not in self.names:
+            return
+
+        expiry = when + self.timeout
+        if expiry <= self.expires.get(mac, float("-inf")):
+            return
+        self.expires[mac] = expiry
+        heapq.heappush(self.heap, (expiry, mac))
+        if mac not in self.present:
+            self.present.add(mac)
+            self.missing_macs.discard(mac)
+            self.version += 1
+
+    def _expire(self, now):
+        heap = self.heap
+        while heap and heap[0][0] < now:
+            expiry, mac = heapq.heappop(heap)
+            # Only the newest entry for a mac counts
+            if self.expires.get(mac) == expiry:
+                del self.expires[mac]
+                self.present.discard(mac)
+                self.missing_macs.add(mac)
+                self.version += 1
+
+    def missing(self, now):
+        """
+        Names of registered items not seen within `timeout` seconds of `now`.
+        """
+        return [name for _, name in self.missing_entries(now)]
+
+    def missing_entries(self, now):
+        """
+        Same as missing(), as (mac, name) pairs.
+        """
+        return self.snapshot(now)[1]
+
+    def snapshot(self, now):
+        """
+        (version, missing_entries(now)) taken under one lock.
+        """
+        with self.lock:
+            self._expire(now)
+            return self.version, [(mac, self.names[mac]) for mac in self.missing_macs]
+
+    def version_at(self, now):
+        """
+        The version after expiring everything older than `now`.
+        """
+        with self.lock:
+            self._expire(now)
+            return self.version
@@ -1,9 +1,20 @@
+import argparse
 import json
 import time
 import threading
 import paho.mqtt.client as mqtt
-import RPi.GPIO as GPIO
 from datetime import datetime
+import database
+from allowlist import MacAllowlist
+from registry import ItemRegistry
+from state import LastSeenStore, MissingItemIndex, RoomTable
+from journal import EventJournal, FSYNC_INTERVAL
+from presence import PresenceEngine
+from ingest import IngestQueue, DROP_OLDEST, COALESCE
+from capture import CaptureWriter
+from speculation import ExitSpeculator
+from rollup import SightingRollup
+from metrics import Metrics, serve as serve_metrics
 
 # ---------------- CONFIG ----------------
 MQTT_BROKER = "localhost"
@@ -11,116 +22,520 @@ MQTT_TOPIC = "ble/#"
 
 PIR_PIN = 17
 EXIT_TIMEOUT_SECONDS = 20   # How recent an item must be seen to count as "with you"
+FRONT_DOOR_ROOMS = ("Front Door", "FrontDoor")  # Room names the door scanner may report
 
 LAST_SEEN_FILE = "last_seen.json"
-LOG_FILE = "log.json"
-REGISTERED_ITEMS_FILE = "registered_items.json"
+LOG_DIR = "log_journal"       # Append-only event journal segments (events-000001.jsonl, ...)
+LAST_SEEN_FLUSH_SECONDS = 10   # How often the in-memory last seen table is written to disk
+LAST_SEEN_WAL_FSYNC_SECONDS = 1.0   # fsync the last seen write-ahead log at most this often
+LAST_SEEN_WAL_MAX_RECORDS = 50000   # Snapshot early once the WAL gets this long
+LAST_SEEN_CAPACITY = 10000          # Most MACs kept in the last seen table, registered items always stay...
+LAST_SEEN_TTL_SECONDS = 7 * 24 * 60 * 60  # ...and unregistered ones go after a week without a sighting
+
+JOURNAL_MAX_BYTES = 8 * 1024 * 1024   # Start a new journal segment past this size
+JOURNAL_MAX_AGE_SECONDS = 24 * 60 * 60  # ...or once the current one is a day old
+JOURNAL_FSYNC = FSYNC_INTERVAL        # "always", "interval" or "never"
+JOURNAL_FSYNC_INTERVAL = 1.0
+
+INGEST_QUEUE_SIZE = 1000            # Messages buffered between MQTT and the worker
+INGEST_OVERFLOW_POLICY = DROP_OLDEST  # DROP_OLDEST, COALESCE (per MAC) or BLOCK
+
+ITEMS_RELOAD_SECONDS = 1        # How often to ask SQLite whether the items table changed
+UNREGISTERED_SAMPLE_EVERY = 50  # Keep 1 in N unregistered sightings for diagnostics
+
+DUPLICATE_WINDOW_SECONDS = 30  # Repeat sightings inside this window are only kept in memory...
+DUPLICATE_RSSI_DELTA = 5       # ...if the room is the same and RSSI moved less than this
+
+RSSI_MIN = -128               # dBm a BLE scanner can report; anything outside
+RSSI_MAX = 20                 # makes the whole message a bad one
+
+PRESENCE_MAX_DEVICES = 256    # Preallocated RSSI history slots
+PRESENCE_MAX_ROOMS = 16
+PRESENCE_WINDOW = 8           # RSSI readings averaged per (item, room)
+PRESENCE_HYSTERESIS_DB = 6    # How much stronger a room must be before an item moves
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108           # Prometheus text at /metrics, None to turn off
 # ----------------------------------------
 
 
-# ---------------- GPIO SETUP ----------------
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(PIR_PIN, GPIO.IN)
+# ---------------- STATE ----------------
+# Inside the tracker MACs are 48-bit ints, rooms are interned ids and times
+# are epoch seconds; strings only appear in files, the journal and output
+rooms = RoomTable()
+FRONT_DOOR = frozenset(rooms.intern(name) for name in FRONT_DOOR_ROOMS)
+
+last_seen = LastSeenStore(
+    LAST_SEEN_FILE,
+    rooms,
+    LAST_SEEN_FLUSH_SECONDS,
+    wal_fsync_interval=LAST_SEEN_WAL_FSYNC_SECONDS,
+    wal_max_records=LAST_SEEN_WAL_MAX_RECORDS,
+    capacity=LAST_SEEN_CAPACITY,
+    ttl=LAST_SEEN_TTL_SECONDS,
+)
+journal = EventJournal(
+    LOG_DIR,
+    max_bytes=JOURNAL_MAX_BYTES,
+    max_age=JOURNAL_MAX_AGE_SECONDS,
+    fsync=JOURNAL_FSYNC,
+    fsync_interval=JOURNAL_FSYNC_INTERVAL,
+)
+ingest_queue = IngestQueue(INGEST_QUEUE_SIZE, INGEST_OVERFLOW_POLICY)
+missing_index = MissingItemIndex(EXIT_TIMEOUT_SECONDS)
+presence = PresenceEngine(
+    max_devices=PRESENCE_MAX_DEVICES,
+    max_rooms=PRESENCE_MAX_ROOMS,
+    window=PRESENCE_WINDOW,
+    hysteresis_db=PRESENCE_HYSTERESIS_DB,
+    stale_seconds=EXIT_TIMEOUT_SECONDS,
+)
+
+# mac << 16 | room id -> (rssi, time) of the last sighting that was persisted
+last_persisted = {}
+
+# mac -> items table id, for the sightings table, as of registry generation item_ids_generation
+item_ids = {}
+item_ids_generation = None
+duplicate_stats = {"persisted": 0, "coalesced": 0}
+
+# Set by --record, see capture.py
+capture_writer = None
+
+# Per-stage latency, see metrics.py
+metrics = Metrics()
+STAGE = "tracker_stage_seconds"
+STAGE_HELP = "Time spent per processing stage"
+decode_seconds = metrics.histogram(STAGE, STAGE_HELP, stage="decode")
+state_seconds = metrics.histogram(STAGE, STAGE_HELP, stage="state")
+speculate_seconds = metrics.histogram(STAGE, STAGE_HELP, stage="speculate")
+journal_seconds = metrics.histogram(STAGE, STAGE_HELP, stage="journal")
+exit_check_seconds = metrics.histogram(STAGE, STAGE_HELP, stage="exit_check")
+print_seconds = metrics.histogram(STAGE, STAGE_HELP, stage="print")
+bad_messages = metrics.counter("tracker_bad_messages_total", "Messages that could not be parsed")
+exit_checks = metrics.counter("tracker_exit_checks_total", "PIR exit checks")
+missing_events = metrics.counter("tracker_missing_items_total", "Items reported missing at exit checks")
 
 
 # ---------------- HELPERS ----------------
-def load_json(path):
-    try:
-        with open(path, "r") as f:
-            return json.load(f)
-    except:
-        return {}
+registry = ItemRegistry()
 
+allowlist = MacAllowlist(registry.names_by_mac, sample_every=UNREGISTERED_SAMPLE_EVERY)
+next_items_check = 0.0
 
-def save_json(path, data):
-    with open(path, "w") as f:
-        json.dump(data, f, indent=4)
 
+def registered_items_changed():
+    missing_index.set_registered(allowlist.names)
+    last_seen.set_pinned(allowlist.names)
+    if capture_writer is not None:
+        capture_writer.write_items(time.time(), allowlist.registered())
 
-def log_event(entry):
-    logs = load_json(LOG_FILE)
-    if "events" not in logs:
-        logs["events"] = []
 
-    logs["events"].append(entry)
-    save_json(LOG_FILE, logs)
+def reload_registered_items(force=False):
+    global next_items_check
 
+    # Asks SQLite at most every ITEMS_RELOAD_SECONDS; refresh() only re-reads changed items
+    now = time.monotonic()
+    if force or now >= next_items_check:
+        next_items_check = now + ITEMS_RELOAD_SECONDS
+        registry.refresh(force)
+    apply_registered_items()
 
-# ---------------- MQTT CALLBACK ----------------
-def on_message(client, userdata, msg):
-    payload = json.loads(msg.payload.decode())
 
-    mac = payload["item"]
-    room = payload["room"]
-    rssi = payload.get("rssi", None)
+def apply_registered_items():
+    """
+    Bring the allowlist and item ids up to date with the registry's cache.
+    Only touches memory, and must run where apply_batch does; the asyncio
+    runtime runs registry.refresh() in an executor and then this on its loop.
+    """
+    global item_ids, item_ids_generation
 
-    timestamp = datetime.now().isoformat()
+    if registry.generation == item_ids_generation:
+        return
+    item_ids_generation = registry.generation
+    item_ids = {database.mac_to_int(mac): row[0] for mac, row in registry.by_mac.items()}
+    if allowlist.reload():
+        registered_items_changed()
 
-    # Load current last seen
-    last_seen = load_json(LAST_SEEN_FILE)
 
-    # DO NOT STORE FRONT DOOR AS LAST SEEN
-    if room != "Front Door":
-        last_seen[mac] = {
-            "room": room,
-            "timestamp": timestamp,
-            "rssi": rssi
-        }
-        save_json(LAST_SEEN_FILE, last_seen)
+def set_registered_items(names):
+    if allowlist.replace(names):
+        registered_items_changed()
 
-    # Still log the event
-    log_event({
-        "item": mac,
-        "room": room,
-        "timestamp": timestamp,
-        "rssi": rssi
-    })
 
+def recover_last_seen():
+    stats = last_seen.recover()
+    print(" Recovered last seen state: {entries} items ({wal_records} from WAL) in {ms:.1f} ms".format(
+        ms=stats["seconds"] * 1000, **stats))
+    if "snapshot_error" in stats:
+        print(" Last seen snapshot was unreadable:", stats["snapshot_error"])
 
-# ---------------- EXIT CHECK LOGIC ----------------
-def check_missing_items():
-    print(" Motion detected at front door. Checking items...")
 
-    registered = load_json(REGISTERED_ITEMS_FILE)
-    last_seen = load_json(LAST_SEEN_FILE)
+def seed_missing_index():
+    missing_index.seen_many([(mac, entry.time) for mac, entry in last_seen.entries.items()])
+
+
+def is_duplicate(mac, room, rssi, received):
+    """
+    True if this sighting repeats the last persisted one for (mac, room id)
+    within DUPLICATE_WINDOW_SECONDS and with a similar RSSI.
+    """
+    key = mac << 16 | room
+    prev = last_persisted.get(key)
+    if prev is not None:
+        prev_rssi, prev_time = prev
+        if (received - prev_time < DUPLICATE_WINDOW_SECONDS
+                and rssi is not None and prev_rssi is not None
+                and abs(rssi - prev_rssi) < DUPLICATE_RSSI_DELTA):
+            duplicate_stats["coalesced"] += 1
+            return True
+
+    last_persisted[key] = (rssi, received)
+    duplicate_stats["persisted"] += 1
+    return False
+
+
+def log_event(entry):
+    journal.append(entry)
+
 
-    now = datetime.now()
+def log_events(entries):
+    started = time.monotonic()
+    journal.append_many(entries)
+    journal_seconds.observe(time.monotonic() - started)
 
-    missing_items = []
 
-    for mac, info in registered.items():
-        if mac not in last_seen:
-            missing_items.append(info["name"])
+# ---------------- MQTT CALLBACK ----------------
+def on_connect(client, userdata, flags, rc):
+    # Again after every reconnect; with a clean session the broker forgot the subscription
+    client.subscribe(MQTT_TOPIC)
+
+
+def on_message(client, userdata, msg):
+    # Runs on paho's network thread, so only queue the raw message here
+    received = time.time()
+
+    if capture_writer is not None:
+        capture_writer.write_message(received, msg.topic, msg.payload)
+
+    key = None
+    if INGEST_OVERFLOW_POLICY == COALESCE:
+        try:
+            key = json.loads(msg.payload)["item"]
+        except (ValueError, KeyError, TypeError):
+            pass
+
+    ingest_queue.put((msg.payload, received), key)
+
+
+# ---------------- PROCESSING ----------------
+def parse_sightings(raw):
+    """
+    Return (item, room, rssi, scan_ts) for every sighting in a message.
+
+    Accepts the single-item format {"item", "room", "rssi"} and the batched
+    scan report {"room", "ts", "items": [{"item", "rssi"}, ...]}.
+    """
+    payload = json.loads(raw)
+    room = payload["room"]
+    if not isinstance(room, str):
+        raise TypeError(f"room must be a string, not {type(room).__name__}")
+
+    if "items" in payload:
+        scan_ts = payload.get("ts", None)
+        return [(entry["item"], room, parse_rssi(entry.get("rssi", None)), scan_ts)
+                for entry in payload["items"]]
+
+    return [(payload["item"], room, parse_rssi(payload.get("rssi", None)), None)]
+
+
+def parse_rssi(rssi):
+    """
+    RSSI as an int between RSSI_MIN and RSSI_MAX, or None if not given.
+    """
+    if rssi is None:
+        return None
+    # NaN fails the range check too; bool is an int subclass but not a reading
+    if isinstance(rssi, bool) or not isinstance(rssi, (int, float)) or not RSSI_MIN <= rssi <= RSSI_MAX:
+        raise ValueError(f"bad rssi {rssi!r}")
+    return int(rssi)
+
+
+def apply_batch(batch):
+    """
+    Update in-memory state for a batch of (raw payload, arrival time)
+    messages and return the journal entries it produced.
+    """
+    entries = []
+    stored = []     # (item id, room, time, rssi) for the sightings table
+    changes = {}    # mac -> (room id, time, rssi, persist) for last_seen
+    sightings = []  # (mac, time) for the missing item index
+    front_door = None
+
+    for raw, received in batch:
+        started = time.monotonic()
+        try:
+            parsed = parse_sightings(raw)
+        except (ValueError, KeyError, TypeError) as e:
+            bad_messages.inc()
+            print(" Skipping bad message:", e)
             continue
+        finally:
+            decode_seconds.observe(time.monotonic() - started)
+
+        timestamp = None
+
+        for item, room, rssi, scan_ts in parsed:
+            # Unregistered (mostly randomized) addresses are counted, never stored
+            mac = allowlist.check(item, room, rssi)
+            if mac is None:
+                continue
+
+            room_id = rooms.intern(room)
+            duplicate = is_duplicate(mac, room_id, rssi, received)
+
+            # DO NOT STORE FRONT DOOR AS LAST SEEN
+            if room_id in FRONT_DOOR:
+                # Someone is probably about to walk out, get the exit check ready
+                front_door = received
+                assigned = room_id
+            else:
+                # Smooth over scanners that hear the same item from different rooms
+                if rssi is not None:
+                    assigned = presence.update(mac, room_id, rssi, received)
+                else:
+                    assigned = room_id
+
+                pending = changes.get(mac)
+                if pending is not None:
+                    previous_room = pending[0]
+                else:
+                    previous = last_seen.get(mac)
+                    previous_room = previous.room if previous is not None else None
+
+                # A duplicate in the same room only refreshes the timestamp
+                persist = not (duplicate and previous_room == assigned)
+                if pending is not None and pending[3]:
+                    persist = True
+                changes[mac] = (assigned, received, rssi, persist)
+                sightings.append((mac, received))
+
+            if duplicate:
+                continue
+
+            if timestamp is None:
+                timestamp = datetime.fromtimestamp(received).isoformat()
+
+            # Still log the event
+            entry = {
+                "item": database.format_mac(mac),
+                "room": room,
+                "timestamp": timestamp,
+                "rssi": rssi
+            }
+            if scan_ts is not None:
+                entry["scan_ts"] = scan_ts
+            entries.append(entry)
+
+            # Stored under the room presence placed the item in, so two scanners
+            # hearing it don't both get the time; RSSI only from that room's scanner
+            item_id = item_ids.get(mac)
+            if item_id is not None:
+                stored.append((item_id, rooms.name(assigned), received,
+                               rssi if assigned == room_id else None))
+
+    # One state update for the whole batch
+    if changes:
+        started = time.monotonic()
+        last_seen.apply(changes)
+        missing_index.seen_many(sightings)
+        state_seconds.observe(time.monotonic() - started)
+    if front_door is not None:
+        started = time.monotonic()
+        speculator.speculate(front_door)
+        speculate_seconds.observe(time.monotonic() - started)
+    if stored:
+        # Buffered; committed in batches by the SightingWriter
+        database.sighting_writer().write_many(stored)
+    return entries
+
+
+def process_batch(batch):
+    entries = apply_batch(batch)
+    if entries:
+        log_events(entries)
+
+
+def ingest_worker():
+    while True:
+        batch = ingest_queue.get_batch(ITEMS_RELOAD_SECONDS)
+        if batch is None:
+            break
+
+        try:
+            reload_registered_items()
+            process_batch(batch)
+        except Exception as e:
+            print(" Failed to process batch:", e)
 
-        last_time = datetime.fromisoformat(last_seen[mac]["timestamp"])
-        seconds_since_seen = (now - last_time).total_seconds()
 
-        if seconds_since_seen > EXIT_TIMEOUT_SECONDS:
-            missing_items.append(info["name"])
+# ---------------- EXIT CHECK LOGIC ----------------
+def check_missing_items(now=None):
+    print(" Motion detected at front door. Checking items...")
 
+    if now is None:
+        now = time.time()
+    missing, _ = exit_report(now)
+    missing_items = [name for _, name in missing]
+    print_missing_items(missing_items)
+    return missing_items
+
+
+def exit_report(now):
+    """
+    Missing entries and their (name, room) report for an exit at `now`.
+    """
+    started = time.monotonic()
+    missing, report = speculator.confirm(now)
+    exit_check_seconds.observe(time.monotonic() - started)
+    exit_checks.inc()
+    missing_events.inc(len(missing))
+    return missing, report
+
+
+def describe_missing(missing):
+    """
+    (item name, last seen room) for each (mac, name) missing entry.
+    """
+    report = []
+    for mac, name in missing:
+        seen = last_seen.get(mac)
+        report.append((name, rooms.name(seen.room) if seen is not None else "Unknown room"))
+    return report
+
+
+speculator = ExitSpeculator(missing_index, describe_missing)
+
+
+# ---------------- METRICS ----------------
+def register_metrics():
+    """
+    Expose the counters other parts of the tracker already keep.
+    """
+    metrics.counter("tracker_messages_total", "Messages received from MQTT",
+                    read=lambda: ingest_queue.enqueued)
+    metrics.counter("tracker_messages_dropped_total", "Messages dropped by the ingest queue",
+                    read=lambda: ingest_queue.dropped)
+    metrics.counter("tracker_messages_coalesced_total", "Messages replaced by a newer one for the same item",
+                    read=lambda: ingest_queue.coalesced)
+    metrics.gauge("tracker_ingest_queue_depth", "Messages waiting for the ingest worker",
+                  read=lambda: len(ingest_queue.items))
+    metrics.counter("tracker_sightings_total", "Sightings of registered items",
+                    read=lambda: allowlist.accepted)
+    metrics.counter("tracker_unregistered_sightings_total", "Sightings of unregistered MACs",
+                    read=lambda: allowlist.rejected)
+    metrics.counter("tracker_duplicate_sightings_total", "Sightings only kept in memory",
+                    read=lambda: duplicate_stats["coalesced"])
+    metrics.counter("tracker_exit_speculation_hits_total", "Exit checks answered from the speculation",
+                    read=lambda: speculator.hits)
+    metrics.gauge("tracker_registered_items", "Registered items", read=lambda: len(allowlist.names))
+    metrics.gauge("tracker_last_seen_items", "Items in the last seen table", read=lambda: len(last_seen))
+    metrics.counter("tracker_last_seen_evictions_total", "Unregistered MACs dropped from the last seen table",
+                    read=lambda: last_seen.evicted_ttl, reason="ttl")
+    metrics.counter("tracker_last_seen_evictions_total", "Unregistered MACs dropped from the last seen table",
+                    read=lambda: last_seen.evicted_lru, reason="lru")
+
+
+register_metrics()
+
+
+def print_missing_items(missing_items):
+    started = time.monotonic()
     if missing_items:
         print("❗ Missing Items:")
         for item in missing_items:
             print(" -", item)
     else:
         print(" All items accounted for.")
+    print_seconds.observe(time.monotonic() - started)
 
 
 # ---------------- PIR CALLBACK ----------------
 def pir_callback(channel):
-    check_missing_items()
-
-
-GPIO.add_event_detect(PIR_PIN, GPIO.RISING, callback=pir_callback, bouncetime=3000)
-
-
-# ---------------- MQTT SETUP ----------------
-client = mqtt.Client()
-client.on_message = on_message
-client.connect(MQTT_BROKER, 1883, 60)
-client.subscribe(MQTT_TOPIC)
-
-
-print(" Frontdoor Tracker Running...")
-client.loop_forever()
+    now = time.time()
+    if capture_writer is not None:
+        capture_writer.write_pir(now, channel)
+    check_missing_items(now)
+
+
+# ---------------- MAIN ----------------
+def main(argv=None):
+    global capture_writer
+
+    # Only the runtime on the Pi needs GPIO; sharded.py workers import this module elsewhere
+    import RPi.GPIO as GPIO
+
+    parser = argparse.ArgumentParser(description="Front door item tracker.")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record incoming messages and PIR edges to a capture file (see capture.py)")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        capture_writer = CaptureWriter(args.record)
+        print(" Recording to", args.record)
+
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(PIR_PIN, GPIO.IN)
+    GPIO.add_event_detect(PIR_PIN, GPIO.RISING, callback=pir_callback, bouncetime=3000)
+
+    recover_last_seen()
+    reload_registered_items(force=True)
+    seed_missing_index()
+    last_seen.start()
+    sighting_rollup = SightingRollup()
+    sighting_rollup.start()
+
+    worker = threading.Thread(target=ingest_worker, name="ingest-worker", daemon=True)
+    worker.start()
+
+    metrics_server = None
+    if METRICS_PORT is not None:
+        try:
+            metrics_server = serve_metrics(metrics, METRICS_HOST, METRICS_PORT)
+            print(f" Metrics at http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            print(" Could not start metrics endpoint:", e)
+
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(MQTT_BROKER, 1883, 60)
+
+    print(" Frontdoor Tracker Running...")
+    try:
+        client.loop_forever()
+    finally:
+        # Drain the queue, then write out whatever is still only in memory
+        ingest_queue.close()
+        worker.join()
+        database.flush_sightings()
+        print(" Ingest stats:", ingest_queue.stats())
+        print(" Allowlist stats:", allowlist.stats())
+        print(" Presence stats:", presence.stats())
+        print(" Duplicate stats:", duplicate_stats)
+        print(" Speculation stats:", speculator.stats())
+        print(" Last seen stats:", last_seen.stats())
+        print(" Sighting writer stats:", database.sighting_writer().stats())
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        last_seen.stop()
+        sighting_rollup.stop()
+        print(" Sighting rollup stats:", sighting_rollup.stats())
+        journal.close()
+        if capture_writer is not None:
+            capture_writer.close()
+        GPIO.cleanup()
+
+
+if __name__ == "__main__":
+    main()
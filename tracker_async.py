@@ -0,0 +1,383 @@
+"""
+asyncio runtime for the front door tracker.
+
+Same processing as tracker.py (it reuses its state and apply_batch), but
+everything that touches tracker state runs on one event loop:
+
+- the paho client is driven from the loop's socket readers/writers
+  instead of loop_forever()
+- PIR edges are handed from the GPIO thread to the loop and queued with
+  the sightings, so an exit check sees exactly the sightings before it
+- the journal, last-seen snapshots and notifications are separate tasks
+  fed through bounded queues
+
+Backpressure is applied in one place: when too many events are waiting,
+reading from the MQTT socket is paused until the processor catches up,
+and the processor itself waits whenever the journal queue is full.
+
+    python tracker_async.py [--record PATH]
+"""
+import argparse
+import asyncio
+import json
+import signal
+import threading
+import time
+import urllib.request
+
+import paho.mqtt.client as mqtt
+
+import database
+import tracker
+from capture import CaptureWriter
+from metrics import serve as serve_metrics
+from rollup import SightingRollup
+
+# ---------------- CONFIG ----------------
+RELAY_URL = "http://localhost:5000/alert"   # relay.py endpoint, None to only print
+
+EVENT_HIGH_WATER = tracker.INGEST_QUEUE_SIZE  # Stop reading MQTT past this many waiting events
+EVENT_LOW_WATER = EVENT_HIGH_WATER // 2       # ...and resume once back under this
+MAX_BATCH = 500                               # Sightings applied per state update
+JOURNAL_QUEUE_SIZE = 64                       # Batches waiting for the journal writer
+NOTIFY_QUEUE_SIZE = 16                        # Exit checks waiting to be reported
+RECONNECT_DELAY_SECONDS = 2
+# ----------------------------------------
+
+# Event kinds on the processing queue
+SIGHTING = 0
+PIR = 1
+
+
+class AsyncioMQTT:
+    """
+    Runs a paho client from an asyncio loop using paho's socket callbacks.
+
+    Reconnects run in an executor thread and paho fires the socket
+    callbacks from inside reconnect(), so those are handed back to the
+    loop thread before touching add_reader / add_writer.
+    """
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.loop_thread = threading.get_ident()   # created on the loop
+        self.client = client
+        self.sock = None
+        self.reading = False
+        self.misc = None
+        self.closing = False
+
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def _on_loop(self, callback, *args):
+        if threading.get_ident() == self.loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self._on_loop(self._socket_opened, sock)
+
+    def on_socket_close(self, client, userdata, sock):
+        self._on_loop(self._socket_closed)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock)
+
+    def _socket_opened(self, sock):
+        self.sock = sock
+        self.resume_reading()
+        if self.misc is None:
+            self.misc = self.loop.create_task(self.misc_loop())
+
+    def _socket_closed(self):
+        self.pause_reading()
+        self.sock = None
+
+    def pause_reading(self):
+        if self.reading and self.sock is not None:
+            self.loop.remove_reader(self.sock)
+        self.reading = False
+
+    def resume_reading(self):
+        if not self.reading and self.sock is not None:
+            self.loop.add_reader(self.sock, self.client.loop_read)
+            self.reading = True
+
+    async def misc_loop(self):
+        # Keepalives, retries and reconnects, like loop_forever() would do
+        while not self.closing:
+            if self.client.loop_misc() != mqtt.MQTT_ERR_SUCCESS and not self.closing:
+                try:
+                    await self.loop.run_in_executor(None, self.client.reconnect)
+                except OSError as e:
+                    print(" MQTT reconnect failed:", e)
+                    await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+                    continue
+            await asyncio.sleep(1)
+
+    async def close(self):
+        self.closing = True
+        self.client.disconnect()
+        if self.misc is not None:
+            self.misc.cancel()
+            try:
+                await self.misc
+            except asyncio.CancelledError:
+                pass
+
+
+class AsyncTracker:
+    def __init__(self, loop):
+        self.loop = loop
+        self.events = asyncio.Queue()   # bounded by pausing the socket, see on_message
+        self.journal_queue = asyncio.Queue(JOURNAL_QUEUE_SIZE)
+        self.notify_queue = asyncio.Queue(NOTIFY_QUEUE_SIZE)
+        self.stopping = asyncio.Event()
+        self.mqtt = None
+
+        # Counters
+        self.pauses = 0
+        self.batches = 0
+
+    # ---------------- INPUTS ----------------
+    def on_message(self, client, userdata, msg):
+        # Called on the loop from loop_read()
+        received = time.time()
+        if tracker.capture_writer is not None:
+            tracker.capture_writer.write_message(received, msg.topic, msg.payload)
+
+        self.events.put_nowait((SIGHTING, msg.payload, received))
+        if self.events.qsize() >= EVENT_HIGH_WATER and self.mqtt.reading:
+            self.mqtt.pause_reading()
+            self.pauses += 1
+
+    def pir_callback(self, channel):
+        # Called from the GPIO thread
+        now = time.time()
+        if tracker.capture_writer is not None:
+            tracker.capture_writer.write_pir(now, channel)
+        self.loop.call_soon_threadsafe(self.events.put_nowait, (PIR, channel, now))
+
+    # ---------------- PROCESSING ----------------
+    async def process(self):
+        while True:
+            event = await self.events.get()
+            batch = []
+
+            while event is not None:
+                kind, value, when = event
+                if kind == SIGHTING:
+                    batch.append((value, when))
+                else:
+                    # Everything that arrived before the edge counts for it
+                    await self.apply(batch)
+                    batch = []
+                    await self.exit_check(when)
+
+                if len(batch) >= MAX_BATCH or self.events.empty():
+                    break
+                event = self.events.get_nowait()
+
+            await self.apply(batch)
+
+            if not self.mqtt.reading and self.events.qsize() <= EVENT_LOW_WATER and not self.stopping.is_set():
+                self.mqtt.resume_reading()
+
+            if event is None:
+                return
+
+    async def apply(self, batch):
+        if not batch:
+            return
+        self.batches += 1
+        try:
+            entries = tracker.apply_batch(batch)
+        except Exception as e:
+            # Keep the processor alive; the socket would otherwise stay paused for good
+            tracker.bad_messages.inc(len(batch))
+            print(" Failed to process batch:", e)
+            return
+        if entries:
+            # Waits here when the journal falls behind
+            await self.journal_queue.put(entries)
+
+    async def exit_check(self, now):
+        print(" Motion detected at front door. Checking items...")
+        try:
+            _, report = tracker.exit_report(now)
+        except Exception as e:
+            tracker.bad_messages.inc()
+            print(" Failed to check items:", e)
+            return
+        await self.notify_queue.put(report)
+
+    # ---------------- SINKS ----------------
+    async def journal_sink(self):
+        while True:
+            entries = await self.journal_queue.get()
+            if entries is None:
+                return
+            try:
+                await self.loop.run_in_executor(None, tracker.log_events, entries)
+            except OSError as e:
+                print(" Could not write journal:", e)
+
+    async def snapshot_sink(self):
+        last_flush = time.monotonic()
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), tracker.LAST_SEEN_WAL_FSYNC_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.loop.run_in_executor(None, tracker.last_seen.sync_wal)
+            except OSError as e:
+                print(" Could not write last seen WAL:", e)
+            # Snapshot on the interval, or early so the WAL stays short
+            if (not self.stopping.is_set()
+                    and time.monotonic() - last_flush < tracker.LAST_SEEN_FLUSH_SECONDS
+                    and tracker.last_seen.wal_records < tracker.LAST_SEEN_WAL_MAX_RECORDS):
+                continue
+            last_flush = time.monotonic()
+            tracker.last_seen.evict(time.time())
+            try:
+                await self.loop.run_in_executor(None, tracker.last_seen.flush)
+            except OSError as e:
+                print(" Could not save last seen state:", e)
+
+    async def registry_sink(self):
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), tracker.ITEMS_RELOAD_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                # Only the SQLite read runs off the loop; tracker state is updated on it
+                await self.loop.run_in_executor(None, tracker.registry.refresh)
+            except Exception as e:
+                print(" Could not reload registered items:", e)
+                continue
+            tracker.apply_registered_items()
+
+    async def notify_sink(self):
+        while True:
+            report = await self.notify_queue.get()
+            if report is None:
+                return
+            tracker.print_missing_items([name for name, _ in report])
+            if RELAY_URL is None:
+                continue
+            for name, room in report:
+                try:
+                    await self.loop.run_in_executor(None, send_alert, name, room)
+                except OSError as e:
+                    print(" Could not reach relay:", e)
+
+    def stats(self):
+        return {"pauses": self.pauses, "batches": self.batches, "depth": self.events.qsize()}
+
+
+def send_alert(item, room):
+    data = json.dumps({"item": item, "room": room}).encode()
+    request = urllib.request.Request(RELAY_URL, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        response.read()
+
+
+# ---------------- MAIN ----------------
+async def run(argv=None):
+    parser = argparse.ArgumentParser(description="Front door item tracker (asyncio runtime).")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record incoming messages and PIR edges to a capture file (see capture.py)")
+    args = parser.parse_args(argv)
+
+    loop = asyncio.get_running_loop()
+    app = AsyncTracker(loop)
+
+    if args.record:
+        tracker.capture_writer = CaptureWriter(args.record)
+        print(" Recording to", args.record)
+
+    # apply_batch runs on the loop; WAL records are written by snapshot_sink instead
+    tracker.last_seen.write_behind = True
+    tracker.recover_last_seen()
+    await loop.run_in_executor(None, tracker.registry.refresh, True)
+    tracker.apply_registered_items()
+    tracker.seed_missing_index()
+    sighting_rollup = SightingRollup()
+    sighting_rollup.start()
+
+    # Imported here like in tracker.main(), so importing this module needs no GPIO
+    import RPi.GPIO as GPIO
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(tracker.PIR_PIN, GPIO.IN)
+    GPIO.add_event_detect(tracker.PIR_PIN, GPIO.RISING, callback=app.pir_callback, bouncetime=3000)
+
+    client = mqtt.Client()
+    client.on_connect = tracker.on_connect
+    client.on_message = app.on_message
+    app.mqtt = AsyncioMQTT(loop, client)
+    client.connect(tracker.MQTT_BROKER, 1883, 60)
+
+    tracker.metrics.gauge("tracker_async_events_depth", "Events waiting for the processor",
+                          read=app.events.qsize)
+    metrics_server = None
+    if tracker.METRICS_PORT is not None:
+        try:
+            metrics_server = serve_metrics(tracker.metrics, tracker.METRICS_HOST, tracker.METRICS_PORT)
+        except OSError as e:
+            print(" Could not start metrics endpoint:", e)
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, app.stopping.set)
+
+    processor = loop.create_task(app.process())
+    journal_task = loop.create_task(app.journal_sink())
+    notify_task = loop.create_task(app.notify_sink())
+    background = [loop.create_task(app.snapshot_sink()), loop.create_task(app.registry_sink())]
+
+    print(" Frontdoor Tracker Running (asyncio)...")
+    try:
+        await app.stopping.wait()
+    finally:
+        # Stop input, then drain each queue in pipeline order
+        app.stopping.set()
+        await app.mqtt.close()
+        app.events.put_nowait(None)
+        await processor
+        await app.journal_queue.put(None)
+        await app.notify_queue.put(None)
+        await asyncio.gather(journal_task, notify_task, *background)
+        await loop.run_in_executor(None, database.flush_sightings)
+
+        print(" Async stats:", app.stats())
+        print(" Allowlist stats:", tracker.allowlist.stats())
+        print(" Presence stats:", tracker.presence.stats())
+        print(" Duplicate stats:", tracker.duplicate_stats)
+        print(" Speculation stats:", tracker.speculator.stats())
+        print(" Last seen stats:", tracker.last_seen.stats())
+        print(" Sighting writer stats:", database.sighting_writer().stats())
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        tracker.last_seen.stop()
+        sighting_rollup.stop()
+        print(" Sighting rollup stats:", sighting_rollup.stats())
+        tracker.journal.close()
+        if tracker.capture_writer is not None:
+            tracker.capture_writer.close()
+        GPIO.cleanup()
+
+
+def main(argv=None):
+    asyncio.run(run(argv))
+
+
+if __name__ == "__main__":
+    main()